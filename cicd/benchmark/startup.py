@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Checks the cold start time of the stackql-deploy CLI.
+
+Fails if modules which are only needed once a command runs (pystackql, jinja2, dotenv) are imported
+at startup.  Each command's --help is then run in a fresh interpreter and the best of several runs is
+reported, timings only fail the check if a --budget is given, as they depend on the machine.
+
+usage: python cicd/benchmark/startup.py [--runs N] [--budget SECONDS]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+REPOSITORY_ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+COMMANDS = ['', 'build', 'test', 'teardown', 'bundle', 'info', 'shell', 'upgrade', 'init', 'completion']
+
+DEFERRED_MODULES = ['pystackql', 'jinja2', 'dotenv']
+
+CLI = "import sys; from stackql_deploy.cli import cli; sys.argv[0] = 'stackql-deploy'; cli()"
+
+CHECK_IMPORTS = (
+    "import sys, stackql_deploy.cli; "
+    f"print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+)
+
+def run(code, *args):
+    env = dict(os.environ, PYTHONPATH=REPOSITORY_ROOT)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', code, *args], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        sys.exit(f"stackql-deploy {' '.join(args)} failed:\n{result.stderr.decode()}")
+    return elapsed, result.stdout.decode().strip()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='runs per command, the fastest is reported')
+    parser.add_argument(
+        '--budget', type=float, default=None, help='maximum startup time in seconds, not enforced by default'
+    )
+    args = parser.parse_args()
+
+    failures = []
+
+    _, loaded = run(CHECK_IMPORTS)
+    if loaded:
+        failures.append(f"modules imported at startup: {loaded}")
+
+    # the interpreter alone, for reference
+    baseline = min(run('pass')[0] for _ in range(args.runs))
+    print(f"{'python':<28}{baseline:.3f}s")
+
+    for command in COMMANDS:
+        cli_args = [command, '--help'] if command else ['--help']
+        elapsed = min(run(CLI, *cli_args)[0] for _ in range(args.runs))
+        label = f"stackql-deploy {command}".strip()
+        print(f"{label:<28}{elapsed:.3f}s")
+        if args.budget is not None and elapsed > args.budget:
+            failures.append(f"{label} took {elapsed:.3f}s, budget is {args.budget:.3f}s")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
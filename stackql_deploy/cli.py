@@ -6,28 +6,42 @@ import subprocess
 
 from . import __version__ as deploy_version
 
-from .lib.bootstrap import logger
+from .lib.bootstrap import logger, flush_logs
 from .lib.utils import print_unicode_box, BorderColor
+from .lib.tracing import trace_run
 # from .cmd.build import StackQLProvisioner
 # from .cmd.test import StackQLTestRunner
 # from .cmd.teardown import StackQLDeProvisioner
-from jinja2 import Environment, FileSystemLoader
-from dotenv import dotenv_values
-from pystackql import StackQL
+# jinja2, dotenv and pystackql are imported by the commands which use them, so the CLI starts quickly
 
 #
 # utility functions
 #
 
-def get_stackql_instance(custom_registry=None, download_dir=None):
-    """Initializes StackQL with the given options."""
+def get_stackql_instance(custom_registry=None, download_dir=None, server=None, server_pool_size=4):
+    """Initializes StackQL with the given options, using a pool of connections to a stackql server if provided."""
+    if server:
+        from .lib.server import StackQLServerPool
+        if custom_registry or download_dir:
+            logger.warning("--custom-registry and --download-dir are ignored when using --server")
+        try:
+            return StackQLServerPool(server, logger, pool_size=server_pool_size)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--server')
+        except Exception as e:
+            raise click.ClickException(f"unable to connect to stackql server at {server}: {str(e).strip()}")
+
+    from pystackql import StackQL
+    from .lib.binary import cached_binary_version
+
     stackql_kwargs = {}
     if custom_registry:
         stackql_kwargs['custom_registry'] = custom_registry
     if download_dir:
         stackql_kwargs['download_dir'] = download_dir
 
-    return StackQL(**stackql_kwargs)
+    with cached_binary_version(logger):
+        return StackQL(**stackql_kwargs)
 
 def find_stackql_binary(stackql_bin_path, download_dir):
     """Find the stackql binary in the specified paths."""
@@ -45,6 +59,8 @@ def find_stackql_binary(stackql_bin_path, download_dir):
 
 def load_env_vars(env_file, overrides):
     """Load environment variables from a file and apply overrides."""
+    from dotenv import dotenv_values
+
     dotenv_path = os.path.join(os.getcwd(), env_file)
     env_vars = {}
 
@@ -81,6 +97,13 @@ def setup_logger(command, args_dict):
     logger.setLevel(log_level)
     logger.debug(f"'{command}' command called with args: {str(args_dict)}")
 
+def use_probe_coalescing(coalesce_probes, jobs):
+    """Probes are only issued concurrently by multiple workers, with one each probe would wait for nothing."""
+    if coalesce_probes and jobs < 2:
+        logger.warning("--coalesce-probes has no effect without --jobs greater than 1, probes are not coalesced")
+        return False
+    return coalesce_probes
+
 def add_common_options(command):
     common_options = [
         click.option('--log-level', default='INFO', help='set the logging level.'),
@@ -99,7 +122,23 @@ def add_common_options(command):
             type=click.Choice(["rollback", "ignore", "error"]),
             default="error",
             help="action on failure.",
-        )
+        ),
+        click.option('--no-query-cache', is_flag=True,
+                     help='disable the run-scoped cache of query results.'),
+        click.option('--coalesce-probes', is_flag=True,
+                     help='combine concurrent exists and state checks into batched queries (requires --jobs > 1).'),
+        click.option('--snapshot-cache', is_flag=True,
+                     help='evaluate queries against local snapshots of provider table slices.'),
+        click.option('--snapshot-ttl', default=60, type=click.IntRange(min=0),
+                     help='seconds before a provider table snapshot is re-fetched.'),
+        click.option('--resource', 'resource_patterns', multiple=True, metavar='NAME',
+                     help='only process resources matching NAME (glob patterns allowed, repeatable).'),
+        click.option('--with-dependents', is_flag=True,
+                     help='also process resources which depend on those selected with --resource.'),
+        click.option('--refresh-providers', is_flag=True,
+                     help='re-resolve provider versions rather than using stackql_providers.lock (updated by build).'),
+        click.option('--trace-file', default=None, metavar='PATH',
+                     help='write a trace of the run (resources, phases and stackql calls) as OTLP JSON.')
     ]
     for option in common_options:
         command = option(command)
@@ -111,7 +150,11 @@ def add_stackql_kwarg_options(command):
         click.option('--custom-registry', default=None,
                     help='custom registry URL for StackQL.'),
         click.option('--download-dir', default=None,
-                    help='download directory for StackQL.')
+                    help='download directory for StackQL.'),
+        click.option('--server', default=None, metavar='HOST:PORT',
+                    help='run queries against a running stackql server (stackql srv) instead of the stackql binary.'),
+        click.option('--server-pool-size', default=4, type=click.IntRange(min=1),
+                    help='maximum number of connections to the stackql server.')
     ]
     for option in stackql_options:
         command = option(command)
@@ -139,6 +182,8 @@ def setup_command_context(
     on_failure,
     custom_registry,
     download_dir,
+    server,
+    server_pool_size,
     command_name
 ):
     """Common initialization for commands."""
@@ -146,7 +191,7 @@ def setup_command_context(
     setup_logger(command_name, locals())
 
     # Initialize the StackQL instance and environment variables
-    stackql = get_stackql_instance(custom_registry, download_dir)
+    stackql = get_stackql_instance(custom_registry, download_dir, server, server_pool_size)
 
     # Load environment variables from the file and apply overrides
     env_vars = load_env_vars(env_file, env)
@@ -164,29 +209,49 @@ def setup_command_context(
 @add_stackql_kwarg_options
 @click.option('--output-file', default=None,
               help='File path to write deployment outputs as JSON.')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='maximum number of independent resources to process concurrently.')
+@click.option('--state-file', default=None,
+              help='state file recording resource exports (default: .stackql-deploy/<stack_env>.state.json).')
+@click.option('--incremental', is_flag=True,
+              help='skip checks for resources unchanged since they were last deployed.')
+@click.option('--incremental-ttl', default=3600, type=click.IntRange(min=0),
+              help='seconds a deployment recorded in the state file is trusted for with --incremental.')
 @click.pass_context
 def build(ctx, stack_dir, stack_env, log_level, env_file,
-          env, dry_run, show_queries, on_failure,
-          custom_registry, download_dir, output_file):
+          env, dry_run, show_queries, on_failure, no_query_cache, coalesce_probes,
+          snapshot_cache, snapshot_ttl, resource_patterns, with_dependents, refresh_providers, trace_file,
+          custom_registry, download_dir, server, server_pool_size, output_file, jobs, state_file,
+          incremental, incremental_ttl):
     """Create or update resources."""
 
     from .cmd.build import StackQLProvisioner
 
-    stackql, env_vars = setup_command_context(
-        ctx, stack_dir, stack_env, log_level, env_file,
-        env, dry_run, show_queries, on_failure, custom_registry, download_dir, 'build'
-    )
-    provisioner = StackQLProvisioner(
-        stackql, env_vars, logger, stack_dir, stack_env)
-    stack_name_display = (
-        provisioner.stack_name if provisioner.stack_name
-        else stack_dir
-    )
-    message = (f"Deploying stack: [{stack_name_display}] "
-               f"to environment: [{stack_env}]")
-    print_unicode_box(message, BorderColor.YELLOW)
+    with trace_run(trace_file, 'build', stack_dir, stack_env, logger):
+        stackql, env_vars = setup_command_context(
+            ctx, stack_dir, stack_env, log_level, env_file,
+            env, dry_run, show_queries, on_failure, custom_registry, download_dir,
+            server, server_pool_size, 'build'
+        )
+        provisioner = StackQLProvisioner(
+            stackql, env_vars, logger, stack_dir, stack_env, query_cache=not no_query_cache,
+            coalesce_probes=use_probe_coalescing(coalesce_probes, jobs),
+            snapshot_ttl=snapshot_ttl if snapshot_cache else None,
+            refresh_providers=refresh_providers,
+            update_providers_lock=not dry_run)
+        stack_name_display = (
+            provisioner.stack_name if provisioner.stack_name
+            else stack_dir
+        )
+        message = (f"Deploying stack: [{stack_name_display}] "
+                   f"to environment: [{stack_env}]")
+        print_unicode_box(message, BorderColor.YELLOW)
 
-    provisioner.run(dry_run, show_queries, on_failure, output_file)
+        provisioner.run(
+            dry_run, show_queries, on_failure, output_file, jobs, state_file, incremental_ttl if incremental else None,
+            resource_patterns, with_dependents
+        )
+    flush_logs()
     click.echo("🎯 dry-run build complete" if dry_run
                else "🚀 build complete")
 
@@ -199,29 +264,44 @@ def build(ctx, stack_dir, stack_env, log_level, env_file,
 @click.argument('stack_env')
 @add_common_options
 @add_stackql_kwarg_options
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='maximum number of independent resources to de-provision concurrently.')
+@click.option('--from-state', is_flag=True,
+              help='use exports recorded in the state file by build rather than querying each resource.')
+@click.option('--state-file', default=None,
+              help='state file recording resource exports (default: .stackql-deploy/<stack_env>.state.json).')
 @click.pass_context
 def teardown(ctx, stack_dir, stack_env, log_level, env_file,
-             env, dry_run, show_queries, on_failure,
-             custom_registry, download_dir ):
+             env, dry_run, show_queries, on_failure, no_query_cache, coalesce_probes,
+             snapshot_cache, snapshot_ttl, resource_patterns, with_dependents, refresh_providers, trace_file,
+             custom_registry, download_dir, server, server_pool_size, jobs, from_state, state_file):
     """Teardown a provisioned stack."""
 
     from .cmd.teardown import StackQLDeProvisioner
 
-    stackql, env_vars = setup_command_context(
-        ctx, stack_dir, stack_env, log_level, env_file,
-        env, dry_run, show_queries, on_failure, custom_registry, download_dir, 'teardown'
-    )
-    deprovisioner = StackQLDeProvisioner(
-        stackql, env_vars, logger, stack_dir, stack_env)
-    stack_name_display = (
-        deprovisioner.stack_name if deprovisioner.stack_name
-        else stack_dir
-    )
-    message = (f"Tearing down stack: [{stack_name_display}] "
-               f"in environment: [{stack_env}]")
-    print_unicode_box(message, BorderColor.YELLOW)
+    with trace_run(trace_file, 'teardown', stack_dir, stack_env, logger):
+        stackql, env_vars = setup_command_context(
+            ctx, stack_dir, stack_env, log_level, env_file,
+            env, dry_run, show_queries, on_failure, custom_registry, download_dir,
+            server, server_pool_size, 'teardown'
+        )
+        deprovisioner = StackQLDeProvisioner(
+            stackql, env_vars, logger, stack_dir, stack_env, query_cache=not no_query_cache,
+            coalesce_probes=use_probe_coalescing(coalesce_probes, jobs),
+            snapshot_ttl=snapshot_ttl if snapshot_cache else None,
+            refresh_providers=refresh_providers)
+        stack_name_display = (
+            deprovisioner.stack_name if deprovisioner.stack_name
+            else stack_dir
+        )
+        message = (f"Tearing down stack: [{stack_name_display}] "
+                   f"in environment: [{stack_env}]")
+        print_unicode_box(message, BorderColor.YELLOW)
 
-    deprovisioner.run(dry_run, show_queries, on_failure)
+        deprovisioner.run(
+            dry_run, show_queries, on_failure, jobs, from_state, state_file, resource_patterns, with_dependents
+        )
+    flush_logs()
     click.echo(f"🚧 teardown complete (dry run: {dry_run})")
 
 
@@ -236,30 +316,62 @@ def teardown(ctx, stack_dir, stack_env, log_level, env_file,
 @add_stackql_kwarg_options
 @click.option('--output-file', default=None,
               help='File path to write deployment outputs as JSON.')
+@click.option('--jobs', default=1, type=click.IntRange(min=1),
+              help='maximum number of resources to test concurrently.')
 @click.pass_context
 def test(ctx, stack_dir, stack_env, log_level, env_file,
-         env, dry_run, show_queries, on_failure, custom_registry, download_dir, output_file):
+         env, dry_run, show_queries, on_failure, no_query_cache, coalesce_probes,
+         snapshot_cache, snapshot_ttl, resource_patterns, with_dependents, refresh_providers, trace_file,
+         custom_registry, download_dir, server, server_pool_size, output_file, jobs):
     """Run test queries for the stack."""
 
     from .cmd.test import StackQLTestRunner
 
-    stackql, env_vars = setup_command_context(
-        ctx, stack_dir, stack_env, log_level, env_file,
-        env, dry_run, show_queries, on_failure, custom_registry, download_dir, 'test'
-    )
-    test_runner = StackQLTestRunner(
-        stackql, env_vars, logger, stack_dir, stack_env)
-    stack_name_display = (
-        test_runner.stack_name if test_runner.stack_name
-        else stack_dir
-    )
-    message = (f"Testing stack: [{stack_name_display}] "
-               f"in environment: [{stack_env}]")
-    print_unicode_box(message, BorderColor.YELLOW)
+    with trace_run(trace_file, 'test', stack_dir, stack_env, logger):
+        stackql, env_vars = setup_command_context(
+            ctx, stack_dir, stack_env, log_level, env_file,
+            env, dry_run, show_queries, on_failure, custom_registry, download_dir,
+            server, server_pool_size, 'test'
+        )
+        test_runner = StackQLTestRunner(
+            stackql, env_vars, logger, stack_dir, stack_env, query_cache=not no_query_cache,
+            coalesce_probes=use_probe_coalescing(coalesce_probes, jobs),
+            snapshot_ttl=snapshot_ttl if snapshot_cache else None,
+            refresh_providers=refresh_providers)
+        stack_name_display = (
+            test_runner.stack_name if test_runner.stack_name
+            else stack_dir
+        )
+        message = (f"Testing stack: [{stack_name_display}] "
+                   f"in environment: [{stack_env}]")
+        print_unicode_box(message, BorderColor.YELLOW)
 
-    test_runner.run(dry_run, show_queries, on_failure, output_file)
+        test_runner.run(dry_run, show_queries, on_failure, output_file, jobs, resource_patterns, with_dependents)
+    flush_logs()
     click.echo(f"🔍 tests complete (dry run: {dry_run})")
 
+#
+# bundle command
+#
+
+@cli.command()
+@click.argument('stack_dir')
+@click.option('--log-level', default='INFO', help='set the logging level.')
+@click.option('-o', '--output-file', default=None,
+              help='bundle file to write (default: <stack_dir>.bundle).')
+@click.pass_context
+def bundle(ctx, stack_dir, log_level, output_file):
+    """Create a precompiled bundle of a stack for build, test and teardown."""
+
+    from .lib.bundle import create_bundle, get_bundle_file_path
+    from .lib.filters import setup_environment
+
+    setup_logger('bundle', locals())
+    output_file = output_file or get_bundle_file_path(stack_dir)
+    env = setup_environment(stack_dir, logger)
+    header = create_bundle(env, stack_dir, output_file, logger)
+    print_unicode_box(f"Bundled stack: [{header['stack_name']}] to: [{output_file}]", BorderColor.YELLOW)
+
 #
 # info command
 #
@@ -432,6 +544,8 @@ def create_project_structure(stack_name, provider=None):
     elif provider == 'aws':
         sample_res_name = 'example_vpc'
 
+    from jinja2 import Environment, FileSystemLoader
+
     template_base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', provider)
     env = Environment(loader=FileSystemLoader(template_base_path))
 
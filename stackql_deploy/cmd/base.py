@@ -1,6 +1,7 @@
 # cmd/base.py
 import os
 import json
+import threading
 from ..lib.utils import (
     perform_retries,
     run_stackql_command,
@@ -10,20 +11,64 @@ from ..lib.utils import (
     show_query,
     check_all_dicts,
     check_exports_as_statecheck_proxy,
+    normalize_value,
+    get_type,
+    count_rows,
 )
-from ..lib.config import load_manifest, get_global_context_and_providers
+from ..lib.cache import QueryCache
+from ..lib.coalesce import ProbeCoalescer
+from ..lib.snapshot import SnapshotCache
+from ..lib.config import load_manifest, get_global_context_and_providers, get_full_context, PropContextCache
+from ..lib.scheduler import get_resource_dependencies, get_resource_references, select_resources
+from ..lib.templating import get_queries, render_inline_template, warm_query_cache, add_bundled_query_files
+from ..lib.bundle import is_bundle, load_bundle
+from ..lib.tracing import span, resource_span_attributes, traced_resource
 from ..lib.filters import setup_environment
 
 class StackQLBase:
-    def __init__(self, stackql, vars, logger, stack_dir, stack_env):
+    def __init__(
+        self,
+        stackql,
+        vars,
+        logger,
+        stack_dir,
+        stack_env,
+        query_cache=True,
+        coalesce_probes=False,
+        snapshot_ttl=None,
+        refresh_providers=False,
+        update_providers_lock=False
+    ):
         self.stackql = stackql
         self.vars = vars
         self.logger = logger
         self.stack_dir = stack_dir
         self.stack_env = stack_env
-        self.env = setup_environment(self.stack_dir, self.logger)
-        self.manifest = load_manifest(self.stack_dir, self.logger)
-        self.stack_name = self.manifest.get('name', stack_dir)
+        if is_bundle(stack_dir):
+            # the manifest, query files and compiled templates are loaded from a bundle
+            bundle = load_bundle(stack_dir, self.logger)
+            self.stack_dir = bundle['stack_dir']
+            self.env = setup_environment(self.stack_dir, self.logger, bundle['templates'])
+            self.manifest = bundle['manifest']
+            add_bundled_query_files(self.stack_dir, bundle['query_files'])
+        else:
+            self.env = setup_environment(self.stack_dir, self.logger)
+            self.manifest = load_manifest(self.stack_dir, self.logger)
+            # query files are parsed once up front, then only re-parsed if they change
+            warm_query_cache(self.stack_dir, self.logger)
+        self.stack_name = self.manifest.get('name', self.stack_dir)
+        if getattr(self.stackql, 'server_mode', False):
+            self.check_server_mode_auth()
+        # guards global_context when resources are processed concurrently
+        self.context_lock = threading.RLock()
+        # values exported by each resource, recorded in the state file by build
+        self.resource_exports = {}
+        # run-scoped cache of query results, invalidated by writes
+        self.query_cache = QueryCache(self.logger) if query_cache else None
+        # rendered props of each resource, re-rendered only when a value they reference changes
+        self.prop_context_cache = PropContextCache(self.env, self.logger)
+        # context variables read by each resource, keyed by id(resource)
+        self.resource_references = {}
         self.global_context, self.providers = get_global_context_and_providers(
             self.env,
             self.manifest,
@@ -31,8 +76,38 @@ class StackQLBase:
             self.stack_env,
             self.stack_name,
             self.stackql,
-            self.logger
+            self.logger,
+            self.stack_dir,
+            refresh_providers,
+            update_providers_lock
         )
+        if snapshot_ttl is not None:
+            # queries over the same provider table slice are evaluated against a local snapshot
+            self.stackql = SnapshotCache(self.stackql, self.logger, snapshot_ttl)
+        if coalesce_probes:
+            # concurrent count probes are combined into batched queries
+            self.stackql = ProbeCoalescer(self.stackql, self.logger)
+
+    def check_server_mode_auth(self):
+        """Exits if a resource uses custom auth, which a stackql server can't run queries with."""
+        resources = [resource['name'] for resource in self.manifest.get('resources', []) if resource.get('auth')]
+        if resources:
+            catch_error_and_exit(
+                f"custom auth is not supported using a stackql server, configured for resources: {resources}, "
+                f"run the stack without --server or configure the server's authentication instead",
+                self.logger
+            )
+
+    def get_resource_context(self, resource):
+        """Returns the full context for a resource, see `get_full_context`."""
+        references = self.resource_references.get(id(resource))
+        if references is None:
+            references = get_resource_references(self.env, self.stack_dir, resource, self.logger)
+            self.resource_references[id(resource)] = references
+        with self.context_lock:
+            return get_full_context(
+                self.env, self.global_context, resource, self.logger, self.prop_context_cache, references
+            )
 
     def process_custom_auth(
             self,
@@ -103,17 +178,20 @@ class StackQLBase:
                 self.logger.info(f"📦 exporting variables for [{resource['name']}]...")
                 show_query(show_queries, exports_query, self.logger)
                 custom_auth, env_vars = self.process_custom_auth(resource, full_context)
-                exports = run_stackql_query(
-                    exports_query,
-                    self.stackql,
-                    True,
-                    self.logger,
-                    custom_auth=custom_auth,
-                    env_vars=env_vars,
-                    retries=exports_retries,
-                    delay=exports_retry_delay
-                )
-                self.logger.debug(f"exports: {exports}")
+                with span('exports', resource_span_attributes(resource, 'exports')) as exports_span:
+                    exports = run_stackql_query(
+                        exports_query,
+                        self.stackql,
+                        True,
+                        self.logger,
+                        custom_auth=custom_auth,
+                        env_vars=env_vars,
+                        retries=exports_retries,
+                        delay=exports_retry_delay,
+                        cache=self.query_cache
+                    )
+                    exports_span.set_attribute('stackql_deploy.rows', count_rows(exports))
+                self.logger.debug("exports: %s", exports)
 
                 if (exports is None or len(exports) == 0):
                     if ignore_missing_exports:
@@ -167,15 +245,9 @@ class StackQLBase:
                                 # when item is a dictionary,
                                 # compare key(expected_exports) with key(export)
                                 # set val(expected_exports) as key and export[key] as value in export_data
-                                if isinstance(export.get(key), dict) and 'String' in export[key]:
-                                    export_data[val] = export[key]['String']
-                                else:
-                                    export_data[val] = export.get(key, '')
+                                export_data[val] = normalize_value(export.get(key, ''))
                         else:
-                            if isinstance(export.get(item), dict) and 'String' in export[item]:
-                                export_data[item] = export[item]['String']
-                            else:
-                                export_data[item] = export.get(item, '')
+                            export_data[item] = normalize_value(export.get(item, ''))
                 export_vars(self, resource, export_data, expected_exports, all_dicts, protected_exports)
 
     def process_exports_from_result(self, resource, exports_result, expected_exports):
@@ -209,15 +281,9 @@ class StackQLBase:
                     # when item is a dictionary,
                     # compare key(expected_exports) with key(export)
                     # set val(expected_exports) as key and export[key] as value in export_data
-                    if isinstance(export.get(key), dict) and 'String' in export[key]:
-                        export_data[val] = export[key]['String']
-                    else:
-                        export_data[val] = export.get(key, '')
+                    export_data[val] = normalize_value(export.get(key, ''))
             else:
-                if isinstance(export.get(item), dict) and 'String' in export[item]:
-                    export_data[item] = export[item]['String']
-                else:
-                    export_data[item] = export.get(item, '')
+                export_data[item] = normalize_value(export.get(item, ''))
 
         export_vars(self, resource, export_data, expected_exports, all_dicts, protected_exports)
 
@@ -245,17 +311,20 @@ class StackQLBase:
                 self.logger.info(f"🔎 running {check_type} check for [{resource['name']}]...")
                 show_query(show_queries, exists_query, self.logger)
                 custom_auth, env_vars = self.process_custom_auth(resource, full_context)
-                resource_exists = perform_retries(
-                    resource,
-                    exists_query,
-                    exists_retries,
-                    exists_retry_delay,
-                    self.stackql,
-                    self.logger,
-                    delete_test,
-                    custom_auth=custom_auth,
-                    env_vars=env_vars
-                )
+                with span(check_type, resource_span_attributes(resource, 'exists')) as check_span:
+                    resource_exists = perform_retries(
+                        resource,
+                        exists_query,
+                        exists_retries,
+                        exists_retry_delay,
+                        self.stackql,
+                        self.logger,
+                        delete_test,
+                        custom_auth=custom_auth,
+                        env_vars=env_vars,
+                        cache=self.query_cache
+                    )
+                    check_span.set_attribute('stackql_deploy.result', resource_exists)
         else:
             self.logger.info(f"{check_type} check not configured for [{resource['name']}]")
             if delete_test:
@@ -282,17 +351,20 @@ class StackQLBase:
                 self.logger.info(f"🔎 running state check for [{resource['name']}]...")
                 show_query(show_queries, statecheck_query, self.logger)
                 custom_auth, env_vars = self.process_custom_auth(resource, full_context)
-                is_correct_state = perform_retries(
-                    resource,
-                    statecheck_query,
-                    statecheck_retries,
-                    statecheck_retry_delay,
-                    self.stackql,
-                    self.logger,
-                    False,
-                    custom_auth=custom_auth,
-                    env_vars=env_vars
-                )
+                with span('statecheck', resource_span_attributes(resource, 'statecheck')) as check_span:
+                    is_correct_state = perform_retries(
+                        resource,
+                        statecheck_query,
+                        statecheck_retries,
+                        statecheck_retry_delay,
+                        self.stackql,
+                        self.logger,
+                        False,
+                        custom_auth=custom_auth,
+                        env_vars=env_vars,
+                        cache=self.query_cache
+                    )
+                    check_span.set_attribute('stackql_deploy.result', is_correct_state)
                 if is_correct_state:
                     self.logger.info(f"👍 [{resource['name']}] is in the desired state")
                 else:
@@ -321,23 +393,26 @@ class StackQLBase:
                 f"🔎 dry run state check using exports proxy for [{resource['name']}]:\n\n"
                 f"/* exports as statecheck proxy */\n{exports_query}\n"
             )
-            return True
+            return True, None
         else:
             self.logger.info(f"🔎 running state check using exports proxy for [{resource['name']}]...")
             show_query(show_queries, exports_query, self.logger)
             custom_auth, env_vars = self.process_custom_auth(resource, full_context)
 
             # Run exports query with error suppression
-            exports_result = run_stackql_query(
-                exports_query,
-                self.stackql,
-                True,  # suppress_errors=True
-                self.logger,
-                custom_auth=custom_auth,
-                env_vars=env_vars,
-                retries=exports_retries,
-                delay=exports_retry_delay
-            )
+            with span('statecheck', resource_span_attributes(resource, 'exports')) as check_span:
+                exports_result = run_stackql_query(
+                    exports_query,
+                    self.stackql,
+                    True,  # suppress_errors=True
+                    self.logger,
+                    custom_auth=custom_auth,
+                    env_vars=env_vars,
+                    retries=exports_retries,
+                    delay=exports_retry_delay,
+                    cache=self.query_cache
+                )
+                check_span.set_attribute('stackql_deploy.rows', count_rows(exports_result))
 
             # Use exports result as statecheck proxy
             is_correct_state = check_exports_as_statecheck_proxy(exports_result, self.logger)
@@ -373,16 +448,18 @@ class StackQLBase:
             self.logger.info(f"[{resource['name']}] does not exist, creating 🚧...")
             show_query(show_queries, create_query, self.logger)
             custom_auth, env_vars = self.process_custom_auth(resource, full_context)
-            msg = run_stackql_command(
-                create_query,
-                self.stackql,
-                self.logger,
-                custom_auth=custom_auth,
-                env_vars=env_vars,
-                ignore_errors=ignore_errors,
-                retries=create_retries,
-                retry_delay=create_retry_delay
-            )
+            with span('create', resource_span_attributes(resource, 'create')):
+                msg = run_stackql_command(
+                    create_query,
+                    self.stackql,
+                    self.logger,
+                    custom_auth=custom_auth,
+                    env_vars=env_vars,
+                    ignore_errors=ignore_errors,
+                    retries=create_retries,
+                    retry_delay=create_retry_delay,
+                    cache=self.query_cache
+                )
             self.logger.debug(f"create response: {msg}")
             is_created_or_updated = True
         return is_created_or_updated
@@ -406,16 +483,18 @@ class StackQLBase:
                 self.logger.info(f"🔧 updating [{resource['name']}]...")
                 show_query(show_queries, update_query, self.logger)
                 custom_auth, env_vars = self.process_custom_auth(resource, full_context)
-                msg = run_stackql_command(
-                    update_query,
-                    self.stackql,
-                    self.logger,
-                    custom_auth=custom_auth,
-                    env_vars=env_vars,
-                    ignore_errors=ignore_errors,
-                    retries=update_retries,
-                    retry_delay=update_retry_delay
-                )
+                with span('update', resource_span_attributes(resource, 'update')):
+                    msg = run_stackql_command(
+                        update_query,
+                        self.stackql,
+                        self.logger,
+                        custom_auth=custom_auth,
+                        env_vars=env_vars,
+                        ignore_errors=ignore_errors,
+                        retries=update_retries,
+                        retry_delay=update_retry_delay,
+                        cache=self.query_cache
+                    )
                 self.logger.debug(f"update response: {msg}")
                 is_created_or_updated = True
         else:
@@ -440,16 +519,18 @@ class StackQLBase:
                 self.logger.info(f"🚧 deleting [{resource['name']}]...")
                 show_query(show_queries, delete_query, self.logger)
                 custom_auth, env_vars = self.process_custom_auth(resource, full_context)
-                msg = run_stackql_command(
-                    delete_query,
-                    self.stackql,
-                    self.logger,
-                    custom_auth=custom_auth,
-                    env_vars=env_vars,
-                    ignore_errors=ignore_errors,
-                    retries=delete_retries,
-                    retry_delay=delete_retry_delay
-                )
+                with span('delete', resource_span_attributes(resource, 'delete')):
+                    msg = run_stackql_command(
+                        delete_query,
+                        self.stackql,
+                        self.logger,
+                        custom_auth=custom_auth,
+                        env_vars=env_vars,
+                        ignore_errors=ignore_errors,
+                        retries=delete_retries,
+                        retry_delay=delete_retry_delay,
+                        cache=self.query_cache
+                    )
                 self.logger.debug(f"delete response: {msg}")
         else:
             self.logger.info(f"delete query not configured for [{resource['name']}], skipping delete...")
@@ -461,16 +542,84 @@ class StackQLBase:
             else:
                 self.logger.info("🚧 running command...")
                 show_query(show_queries, command_query, self.logger)
-                run_stackql_command(
-                    command_query,
-                    self.stackql,
-                    self.logger,
-                    retries=command_retries,
-                    retry_delay=command_retry_delay
-                )
+                with span('command', {'stackql_deploy.anchor': 'command'}):
+                    run_stackql_command(
+                        command_query,
+                        self.stackql,
+                        self.logger,
+                        retries=command_retries,
+                        retry_delay=command_retry_delay,
+                        cache=self.query_cache
+                    )
         else:
             self.logger.info("command query not configured, skipping command...")
 
+    def select_resources(self, resources, resource_patterns, include_dependents=False):
+        """Returns the indexes of the resources to process and of the upstream resources whose exports they need.
+
+        Every resource is selected if no `resource_patterns` are given.
+        """
+        if not resource_patterns:
+            return set(range(len(resources))), set()
+        references = get_resource_dependencies(
+            self.env, self.stack_dir, resources, self.logger, references_only=True
+        )
+        selected, required = select_resources(
+            resources, references, resource_patterns, self.logger, include_dependents
+        )
+        self.logger.info(f"selected resources: {[resources[index]['name'] for index in sorted(selected)]}")
+        if required:
+            required_names = [resources[index]['name'] for index in sorted(required)]
+            self.logger.info(f"exports will be collected from required resources: {required_names}")
+        return selected, required
+
+    @traced_resource('collect exports')
+    def collect_resource_exports(self, resource, show_queries, dry_run):
+
+        type = get_type(resource, self.logger)
+
+        self.logger.info(f"getting exports for resource [{resource['name']}]")
+
+        # get full context
+        full_context = self.get_resource_context(resource)
+
+        exports_query = None
+
+        # get resource queries
+        if type != 'command':
+            if type == 'query' and 'sql' in resource:
+                # inline SQL specified in the resource
+                test_queries = {}
+                exports_query = render_inline_template(self.env,
+                                                        resource["name"],
+                                                        resource["sql"],
+                                                        full_context,
+                                                        self.logger)
+                exports_retries = 1
+                exports_retry_delay = 0
+            else:
+                test_queries = get_queries(self.env,
+                                            self.stack_dir,
+                                            'resources',
+                                            resource,
+                                            full_context,
+                                            self.logger)
+                exports_query = test_queries.get('exports', {}).get('rendered')
+                exports_retries = test_queries.get('exports', {}).get('options', {}).get('retries', 1)
+                exports_retry_delay = test_queries.get('exports', {}).get('options', {}).get('retry_delay', 0)
+
+        if exports_query:
+            self.process_exports(
+                resource,
+                full_context,
+                exports_query,
+                exports_retries,
+                exports_retry_delay,
+                dry_run,
+                show_queries,
+                ignore_missing_exports=True
+            )
+
     def process_stack_exports(self, dry_run, output_file=None, elapsed_time=None):
         """
         Process root-level exports from manifest and write to JSON file
@@ -8,8 +8,19 @@ from ..lib.utils import (
     print_unicode_box,
     BorderColor
 )
-from ..lib.config import get_full_context, render_value
+from ..lib.config import render_value
 from ..lib.templating import get_queries, render_inline_template
+from ..lib.scheduler import get_resource_dependencies, get_resource_exports, run_resource_graph
+from ..lib.context import as_context_value, render_template
+from ..lib.tracing import span, resource_span_attributes, traced_resource
+from ..lib.state import (
+    get_state_file_path,
+    load_state,
+    new_state,
+    save_state,
+    get_resource_fingerprint,
+    is_resource_unchanged
+)
 from .base import StackQLBase
 
 class StackQLProvisioner(StackQLBase):
@@ -20,7 +31,7 @@ class StackQLProvisioner(StackQLBase):
         if not script_template:
             catch_error_and_exit("script resource must include 'run' key", self.logger)
 
-        script = self.env.from_string(script_template).render(full_context)
+        script = render_template(self.env.from_string(script_template), full_context)
 
         if dry_run:
             dry_run_script = script.replace('""', '"<evaluated>"')
@@ -28,317 +39,249 @@ class StackQLProvisioner(StackQLBase):
         else:
             self.logger.info(f"running script for [{resource['name']}]...")
             try:
-                ret_vars = run_ext_script(script, self.logger, resource.get('exports', None))
+                with span('script', resource_span_attributes(resource, 'run')):
+                    ret_vars = run_ext_script(script, self.logger, resource.get('exports', None))
+                # scripts may change any provider's state
+                if self.query_cache is not None:
+                    self.query_cache.clear()
                 if resource.get('exports', None):
                     self.logger.info(f"exported variables from script: {ret_vars}")
                     export_vars(self, resource, ret_vars, resource.get('exports', []), resource.get('protected', []))
             except Exception as e:
                 catch_error_and_exit(f"script failed: {e}", self.logger)
 
-    def run(self, dry_run, show_queries, on_failure, output_file=None):
+    def process_resource(self, resource, dry_run, show_queries, full_context=None):
+        """Deploys a resource, returns False if it was skipped by its `if` condition."""
 
-        start_time = datetime.datetime.now()
+        type = get_type(resource, self.logger)
 
-        self.logger.info(
-            f"deploying [{self.stack_name}] in [{self.stack_env}] environment {'(dry run)' if dry_run else ''}"
-        )
+        self.logger.info(f"processing resource [{resource['name']}], type: {type}")
 
-        for resource in self.manifest.get('resources', []):
+        # get full context, unless already rendered by the caller
+        if full_context is None:
+            full_context = self.get_resource_context(resource)
 
-            print_unicode_box(f"Processing resource: [{resource['name']}]", BorderColor.BLUE)
-
-            type = get_type(resource, self.logger)
-
-            self.logger.info(f"processing resource [{resource['name']}], type: {type}")
-
-            # get full context
-            full_context = get_full_context(self.env, self.global_context, resource, self.logger)
+        # Check if the resource has an 'if' condition and evaluate it
+        if 'if' in resource:
+            condition = resource['if']
+            try:
+                # Render the condition with the full context to resolve any template variables
+                rendered_condition = render_value(self.env, condition, full_context, self.logger)
+                # Evaluate the condition
+                condition_result = eval(rendered_condition)
+                if not condition_result:
+                    self.logger.info(f"skipping resource [{resource['name']}] due to condition: {condition}")
+                    return False
+            except Exception as e:
+                catch_error_and_exit(
+                    f"error evaluating condition for resource [{resource['name']}]: {e}",
+                    self.logger
+                )
+
+        if type == 'script':
+            self.process_script_resource(resource, dry_run, full_context)
+            return True
+
+        exports_result_from_proxy = None  # Track exports result if used as proxy
+
+        #
+        # get resource queries
+        #
+        if (type == 'command' or type == 'query') and 'sql' in resource:
+            # inline SQL specified in the resource
+            resource_queries = {}
+            inline_query = render_inline_template(self.env,
+                                                    resource["name"],
+                                                    resource["sql"],
+                                                    full_context,
+                                                    self.logger)
+        else:
+            resource_queries = get_queries(self.env,
+                                           self.stack_dir,
+                                           'resources',
+                                           resource,
+                                           full_context,
+                                           self.logger)
+
+        # provisioning queries, anchors are only rendered if their query is run
+        if type in ('resource', 'multi'):
+            # createorupdate queries supercede create and update queries
+            createorupdate_anchor = resource_queries.get('createorupdate', {})
+            createorupdate_retries = resource_queries.get('createorupdate', {}).get('options', {}).get('retries', 1)
+            createorupdate_retry_delay = resource_queries.get(
+                'createorupdate', {}).get('options', {}).get('retry_delay', 0)
+
+            if not createorupdate_anchor:
+                create_anchor = resource_queries.get('create', {})
+                create_retries = resource_queries.get('create', {}).get('options', {}).get('retries', 1)
+                create_retry_delay = resource_queries.get('create', {}).get('options', {}).get('retry_delay', 0)
+
+                update_anchor = resource_queries.get('update', {})
+                update_retries = resource_queries.get('update', {}).get('options', {}).get('retries', 1)
+                update_retry_delay = resource_queries.get('update', {}).get('options', {}).get('retry_delay', 0)
+            else:
+                create_anchor = createorupdate_anchor
+                create_retries = createorupdate_retries
+                create_retry_delay = createorupdate_retry_delay
+                update_anchor = createorupdate_anchor
+                update_retries = createorupdate_retries
+                update_retry_delay = createorupdate_retry_delay
+
+            if not create_anchor:
+                catch_error_and_exit(
+                    "iql file must include either 'create' or 'createorupdate' anchor.",
+                    self.logger
+                )
+
+        # test queries
+        exists_anchor = resource_queries.get('exists', {})
+        exists_retries = resource_queries.get('exists', {}).get('options', {}).get('retries', 1)
+        exists_retry_delay = resource_queries.get('exists', {}).get('options', {}).get('retry_delay', 0)
+
+        statecheck_anchor = resource_queries.get('statecheck', {})
+        statecheck_retries = resource_queries.get('statecheck', {}).get('options', {}).get('retries', 1)
+        statecheck_retry_delay = resource_queries.get('statecheck', {}).get('options', {}).get('retry_delay', 0)
+
+        exports_query = resource_queries.get('exports', {}).get('rendered')
+        exports_retries = resource_queries.get('exports', {}).get('options', {}).get('retries', 1)
+        exports_retry_delay = resource_queries.get('exports', {}).get('options', {}).get('retry_delay', 0)
+
+        if type == 'query' and not exports_query:
+            if 'sql' in resource:
+                exports_query = inline_query
+                exports_retries = 1
+                exports_retry_delay = 0
+            else:
+                catch_error_and_exit(
+                    "inline sql must be supplied or an iql file must be present with an "
+                    "'exports' anchor for query type resources.",
+                    self.logger
+                )
 
-            # Check if the resource has an 'if' condition and evaluate it
-            if 'if' in resource:
-                condition = resource['if']
-                try:
-                    # Render the condition with the full context to resolve any template variables
-                    rendered_condition = render_value(self.env, condition, full_context, self.logger)
-                    # Evaluate the condition
-                    condition_result = eval(rendered_condition)
-                    if not condition_result:
-                        self.logger.info(f"skipping resource [{resource['name']}] due to condition: {condition}")
-                        continue
-                except Exception as e:
-                    catch_error_and_exit(
-                        f"error evaluating condition for resource [{resource['name']}]: {e}",
-                        self.logger
-                    )
+        if type in ('resource', 'multi'):
 
-            if type == 'script':
-                self.process_script_resource(resource, dry_run, full_context)
-                continue
+            ignore_errors = False
+            resource_exists = False
+            is_correct_state = False
+            if type == 'multi':
+                # multi resources ignore errors on create or update
+                ignore_errors  = True
 
             #
-            # get resource queries
+            # OPTIMIZED exists and state check - try exports first for happy path
             #
-            if (type == 'command' or type == 'query') and 'sql' in resource:
-                # inline SQL specified in the resource
-                resource_queries = {}
-                inline_query = render_inline_template(self.env,
-                                                        resource["name"],
-                                                        resource["sql"],
-                                                        full_context,
-                                                        self.logger)
+            if createorupdate_anchor:
+                pass
             else:
-                resource_queries = get_queries(self.env,
-                                               self.stack_dir,
-                                               'resources',
-                                               resource,
-                                               full_context,
-                                               self.logger)
-
-            # provisioning queries
-            if type in ('resource', 'multi'):
-                # createorupdate queries supercede create and update queries
-                createorupdate_query = resource_queries.get('createorupdate', {}).get('rendered')
-                createorupdate_retries = resource_queries.get('createorupdate', {}).get('options', {}).get('retries', 1)
-                createorupdate_retry_delay = resource_queries.get(
-                    'createorupdate', {}).get('options', {}).get('retry_delay', 0)
-
-                if not createorupdate_query:
-                    create_query = resource_queries.get('create', {}).get('rendered')
-                    create_retries = resource_queries.get('create', {}).get('options', {}).get('retries', 1)
-                    create_retry_delay = resource_queries.get('create', {}).get('options', {}).get('retry_delay', 0)
-
-                    update_query = resource_queries.get('update', {}).get('rendered')
-                    update_retries = resource_queries.get('update', {}).get('options', {}).get('retries', 1)
-                    update_retry_delay = resource_queries.get('update', {}).get('options', {}).get('retry_delay', 0)
-                else:
-                    create_query = createorupdate_query
-                    create_retries = createorupdate_retries
-                    create_retry_delay = createorupdate_retry_delay
-                    update_query = createorupdate_query
-                    update_retries = createorupdate_retries
-                    update_retry_delay = createorupdate_retry_delay
-
-                if not create_query:
-                    catch_error_and_exit(
-                        "iql file must include either 'create' or 'createorupdate' anchor.",
-                        self.logger
+                # OPTIMIZATION: Try exports first if available for one-query solution
+                if exports_query:
+                    self.logger.info(
+                        f"🔄 trying exports query first for optimal single-query validation "
+                        f"for [{resource['name']}]"
                     )
-
-            # test queries
-            exists_query = resource_queries.get('exists', {}).get('rendered')
-            exists_retries = resource_queries.get('exists', {}).get('options', {}).get('retries', 1)
-            exists_retry_delay = resource_queries.get('exists', {}).get('options', {}).get('retry_delay', 0)
-
-            statecheck_query = resource_queries.get('statecheck', {}).get('rendered')
-            statecheck_retries = resource_queries.get('statecheck', {}).get('options', {}).get('retries', 1)
-            statecheck_retry_delay = resource_queries.get('statecheck', {}).get('options', {}).get('retry_delay', 0)
-
-            exports_query = resource_queries.get('exports', {}).get('rendered')
-            exports_retries = resource_queries.get('exports', {}).get('options', {}).get('retries', 1)
-            exports_retry_delay = resource_queries.get('exports', {}).get('options', {}).get('retry_delay', 0)
-
-            if type == 'query' and not exports_query:
-                if 'sql' in resource:
-                    exports_query = inline_query
-                    exports_retries = 1
-                    exports_retry_delay = 0
-                else:
-                    catch_error_and_exit(
-                        "inline sql must be supplied or an iql file must be present with an "
-                        "'exports' anchor for query type resources.",
-                        self.logger
+                    is_correct_state, exports_result_from_proxy = self.check_state_using_exports_proxy(
+                        resource,
+                        full_context,
+                        exports_query,
+                        exports_retries,
+                        exports_retry_delay,
+                        dry_run,
+                        show_queries
                     )
+                    resource_exists = is_correct_state
 
-            if type in ('resource', 'multi'):
-
-                ignore_errors = False
-                resource_exists = False
-                is_correct_state = False
-                if type == 'multi':
-                    # multi resources ignore errors on create or update
-                    ignore_errors  = True
-
-                #
-                # OPTIMIZED exists and state check - try exports first for happy path
-                #
-                exports_result_from_proxy = None  # Track exports result if used as proxy
-
-                if createorupdate_query:
-                    pass
-                else:
-                    # OPTIMIZATION: Try exports first if available for one-query solution
-                    if exports_query:
+                    # If exports succeeded, we're done with validation for happy path
+                    if is_correct_state:
                         self.logger.info(
-                            f"🔄 trying exports query first for optimal single-query validation "
-                            f"for [{resource['name']}]"
-                        )
-                        is_correct_state, exports_result_from_proxy = self.check_state_using_exports_proxy(
-                            resource,
-                            full_context,
-                            exports_query,
-                            exports_retries,
-                            exports_retry_delay,
-                            dry_run,
-                            show_queries
-                        )
-                        resource_exists = is_correct_state
-
-                        # If exports succeeded, we're done with validation for happy path
-                        if is_correct_state:
-                            self.logger.info(
-                                f"✅ [{resource['name']}] validated successfully with single exports query"
-                            )
-                        else:
-                            # If exports failed, fall back to traditional exists check
-                            self.logger.info(
-                                f"📋 exports validation failed, falling back to exists check "
-                                f"for [{resource['name']}]"
-                            )
-                            if exists_query:
-                                resource_exists = self.check_if_resource_exists(
-                                    False,  # Reset this since exports failed
-                                    resource,
-                                    full_context,
-                                    exists_query,
-                                    exists_retries,
-                                    exists_retry_delay,
-                                    dry_run,
-                                    show_queries
-                                )
-                            elif statecheck_query:
-                                # statecheck can be used as an exists check fallback
-                                is_correct_state = self.check_if_resource_is_correct_state(
-                                    False,  # Reset this
-                                    resource,
-                                    full_context,
-                                    statecheck_query,
-                                    statecheck_retries,
-                                    statecheck_retry_delay,
-                                    dry_run,
-                                    show_queries
-                                )
-                                resource_exists = is_correct_state
-                            # Reset is_correct_state since we need to re-validate after create/update
-                            is_correct_state = False
-                    elif exists_query:
-                        # Traditional path: exports not available, use exists
-                        resource_exists = self.check_if_resource_exists(
-                            resource_exists,
-                            resource,
-                            full_context,
-                            exists_query,
-                            exists_retries,
-                            exists_retry_delay,
-                            dry_run,
-                            show_queries
+                            f"✅ [{resource['name']}] validated successfully with single exports query"
                         )
-                    elif statecheck_query:
-                        # statecheck can be used as an exists check
-                        is_correct_state = self.check_if_resource_is_correct_state(
-                            is_correct_state,
-                            resource,
-                            full_context,
-                            statecheck_query,
-                            statecheck_retries,
-                            statecheck_retry_delay,
-                            dry_run,
-                            show_queries
-                        )
-                        resource_exists = is_correct_state
                     else:
-                        catch_error_and_exit(
-                            "iql file must include either 'exists', 'statecheck', or 'exports' anchor.",
-                            self.logger
+                        # If exports failed, fall back to traditional exists check
+                        self.logger.info(
+                            f"📋 exports validation failed, falling back to exists check "
+                            f"for [{resource['name']}]"
                         )
-
-                    #
-                    # state check with optimizations (only if we haven't already validated via exports)
-                    #
-                    if resource_exists and not is_correct_state and exports_result_from_proxy is None:
-                        # bypass state check if skip_validation is set to true
-                        if resource.get('skip_validation', False):
-                            self.logger.info(
-                                f"skipping validation for [{resource['name']}] as skip_validation is set to true."
-                            )
-                            is_correct_state = True
-                        elif statecheck_query:
-                            is_correct_state = self.check_if_resource_is_correct_state(
-                                is_correct_state,
+                        if exists_anchor:
+                            resource_exists = self.check_if_resource_exists(
+                                False,  # Reset this since exports failed
                                 resource,
                                 full_context,
-                                statecheck_query,
-                                statecheck_retries,
-                                statecheck_retry_delay,
+                                exists_anchor.get('rendered'),
+                                exists_retries,
+                                exists_retry_delay,
                                 dry_run,
                                 show_queries
                             )
-                        elif exports_query:
-                            # This shouldn't happen since we tried exports first, but keeping for safety
-                            self.logger.info(f"🔄 using exports query as proxy for statecheck for [{resource['name']}]")
-                            is_correct_state, _ = self.check_state_using_exports_proxy(
+                        elif statecheck_anchor:
+                            # statecheck can be used as an exists check fallback
+                            is_correct_state = self.check_if_resource_is_correct_state(
+                                False,  # Reset this
                                 resource,
                                 full_context,
-                                exports_query,
-                                exports_retries,
-                                exports_retry_delay,
+                                statecheck_anchor.get('rendered'),
+                                statecheck_retries,
+                                statecheck_retry_delay,
                                 dry_run,
                                 show_queries
                             )
-
-                #
-                # resource does not exist
-                #
-                is_created_or_updated = False
-                if not resource_exists:
-                    is_created_or_updated = self.create_resource(
-                        is_created_or_updated,
+                            resource_exists = is_correct_state
+                        # Reset is_correct_state since we need to re-validate after create/update
+                        is_correct_state = False
+                elif exists_anchor:
+                    # Traditional path: exports not available, use exists
+                    resource_exists = self.check_if_resource_exists(
+                        resource_exists,
                         resource,
                         full_context,
-                        create_query,
-                        create_retries,
-                        create_retry_delay,
+                        exists_anchor.get('rendered'),
+                        exists_retries,
+                        exists_retry_delay,
                         dry_run,
-                        show_queries,
-                        ignore_errors
+                        show_queries
                     )
-
-                #
-                # resource exists but is not in the correct state
-                #
-                if resource_exists and not is_correct_state:
-                    is_created_or_updated = self.update_resource(
-                        is_created_or_updated,
+                elif statecheck_anchor:
+                    # statecheck can be used as an exists check
+                    is_correct_state = self.check_if_resource_is_correct_state(
+                        is_correct_state,
                         resource,
                         full_context,
-                        update_query,
-                        update_retries,
-                        update_retry_delay,
+                        statecheck_anchor.get('rendered'),
+                        statecheck_retries,
+                        statecheck_retry_delay,
                         dry_run,
-                        show_queries,
-                        ignore_errors
+                        show_queries
+                    )
+                    resource_exists = is_correct_state
+                else:
+                    catch_error_and_exit(
+                        "iql file must include either 'exists', 'statecheck', or 'exports' anchor.",
+                        self.logger
                     )
 
                 #
-                # check state again after create or update with optimizations
+                # state check with optimizations (only if we haven't already validated via exports)
                 #
-                if is_created_or_updated:
-                    if statecheck_query:
+                if resource_exists and not is_correct_state and exports_result_from_proxy is None:
+                    # bypass state check if skip_validation is set to true
+                    if resource.get('skip_validation', False):
+                        self.logger.info(
+                            f"skipping validation for [{resource['name']}] as skip_validation is set to true."
+                        )
+                        is_correct_state = True
+                    elif statecheck_anchor:
                         is_correct_state = self.check_if_resource_is_correct_state(
                             is_correct_state,
                             resource,
                             full_context,
-                            statecheck_query,
+                            statecheck_anchor.get('rendered'),
                             statecheck_retries,
                             statecheck_retry_delay,
                             dry_run,
-                            show_queries,
+                            show_queries
                         )
                     elif exports_query:
-                        # OPTIMIZATION: Use exports as statecheck proxy for post-deploy validation
-                        self.logger.info(
-                            f"🔄 using exports query as proxy for post-deploy statecheck "
-                            f"for [{resource['name']}]"
-                        )
+                        # This shouldn't happen since we tried exports first, but keeping for safety
+                        self.logger.info(f"🔄 using exports query as proxy for statecheck for [{resource['name']}]")
                         is_correct_state, _ = self.check_state_using_exports_proxy(
                             resource,
                             full_context,
@@ -349,51 +292,61 @@ class StackQLProvisioner(StackQLBase):
                             show_queries
                         )
 
-                #
-                # statecheck check complete
-                #
-                if not is_correct_state:
-                    if not dry_run:
-                        catch_error_and_exit(
-                            f"❌ deployment failed for {resource['name']} after post-deploy checks.",
-                            self.logger
-                        )
+            #
+            # resource does not exist
+            #
+            is_created_or_updated = False
+            if not resource_exists:
+                is_created_or_updated = self.create_resource(
+                    is_created_or_updated,
+                    resource,
+                    full_context,
+                    create_anchor.get('rendered'),
+                    create_retries,
+                    create_retry_delay,
+                    dry_run,
+                    show_queries,
+                    ignore_errors
+                )
 
-            if type == 'command':
-                # command queries
-                if 'sql' in resource:
-                    command_query = inline_query
-                    command_retries = 1
-                    command_retry_delay = 0
-                else:
-                    # SQL from file
-                    command_query = resource_queries.get('command', {}).get('rendered')
-                    command_retries = resource_queries.get('command', {}).get('options', {}).get('retries', 1)
-                    command_retry_delay = resource_queries.get('command', {}).get('options', {}).get('retry_delay', 0)
-                if not command_query:
-                    error_msg = (
-                        "'sql' should be defined in the resource or the 'command' anchor "
-                        "needs to be supplied in the corresponding iql file for command "
-                        "type resources."
-                    )
-                    catch_error_and_exit(error_msg, self.logger)
+            #
+            # resource exists but is not in the correct state
+            #
+            if resource_exists and not is_correct_state:
+                is_created_or_updated = self.update_resource(
+                    is_created_or_updated,
+                    resource,
+                    full_context,
+                    update_anchor.get('rendered'),
+                    update_retries,
+                    update_retry_delay,
+                    dry_run,
+                    show_queries,
+                    ignore_errors
+                )
 
-                self.run_command(command_query, command_retries, command_retry_delay, dry_run, show_queries)
             #
-            # exports with optimization
+            # check state again after create or update with optimizations
             #
-            if exports_query:
-                # OPTIMIZATION: Skip exports if we already ran it as a proxy and have the result
-                if exports_result_from_proxy is not None and type in ('resource', 'multi'):
-                    self.logger.info(f"📦 reusing exports result from proxy for [{resource['name']}]...")
-                    # Process the exports result we already have
-                    expected_exports = resource.get('exports', [])
-                    if len(expected_exports) > 0:
-                        # Use helper method to process the exports data directly
-                        self.process_exports_from_result(resource, exports_result_from_proxy, expected_exports)
-                else:
-                    # Run exports normally
-                    self.process_exports(
+            if is_created_or_updated:
+                if statecheck_anchor:
+                    is_correct_state = self.check_if_resource_is_correct_state(
+                        is_correct_state,
+                        resource,
+                        full_context,
+                        statecheck_anchor.get('rendered'),
+                        statecheck_retries,
+                        statecheck_retry_delay,
+                        dry_run,
+                        show_queries,
+                    )
+                elif exports_query:
+                    # OPTIMIZATION: Use exports as statecheck proxy for post-deploy validation
+                    self.logger.info(
+                        f"🔄 using exports query as proxy for post-deploy statecheck "
+                        f"for [{resource['name']}]"
+                    )
+                    is_correct_state, _ = self.check_state_using_exports_proxy(
                         resource,
                         full_context,
                         exports_query,
@@ -403,11 +356,156 @@ class StackQLProvisioner(StackQLBase):
                         show_queries
                     )
 
-            if not dry_run:
-                if type == 'resource':
-                    self.logger.info(f"✅ successfully deployed {resource['name']}")
-                elif type == 'query':
-                    self.logger.info(f"✅ successfully exported variables for query in {resource['name']}")
+            #
+            # statecheck check complete
+            #
+            if not is_correct_state:
+                if not dry_run:
+                    catch_error_and_exit(
+                        f"❌ deployment failed for {resource['name']} after post-deploy checks.",
+                        self.logger
+                    )
+
+        if type == 'command':
+            # command queries
+            if 'sql' in resource:
+                command_query = inline_query
+                command_retries = 1
+                command_retry_delay = 0
+            else:
+                # SQL from file
+                command_query = resource_queries.get('command', {}).get('rendered')
+                command_retries = resource_queries.get('command', {}).get('options', {}).get('retries', 1)
+                command_retry_delay = resource_queries.get('command', {}).get('options', {}).get('retry_delay', 0)
+            if not command_query:
+                error_msg = (
+                    "'sql' should be defined in the resource or the 'command' anchor "
+                    "needs to be supplied in the corresponding iql file for command "
+                    "type resources."
+                )
+                catch_error_and_exit(error_msg, self.logger)
+
+            self.run_command(command_query, command_retries, command_retry_delay, dry_run, show_queries)
+        #
+        # exports with optimization
+        #
+        if exports_query:
+            # OPTIMIZATION: Skip exports if we already ran it as a proxy and have the result
+            if exports_result_from_proxy is not None and type in ('resource', 'multi'):
+                self.logger.info(f"📦 reusing exports result from proxy for [{resource['name']}]...")
+                # Process the exports result we already have
+                expected_exports = resource.get('exports', [])
+                if len(expected_exports) > 0:
+                    # Use helper method to process the exports data directly
+                    self.process_exports_from_result(resource, exports_result_from_proxy, expected_exports)
+            else:
+                # Run exports normally
+                self.process_exports(
+                    resource,
+                    full_context,
+                    exports_query,
+                    exports_retries,
+                    exports_retry_delay,
+                    dry_run,
+                    show_queries
+                )
+
+        if not dry_run:
+            if type == 'resource':
+                self.logger.info(f"✅ successfully deployed {resource['name']}")
+            elif type == 'query':
+                self.logger.info(f"✅ successfully exported variables for query in {resource['name']}")
+        return True
+
+    def save_resource_state(self, resource, fingerprint):
+        """Records the values exported by a resource in the state file."""
+        with self.context_lock:
+            self.state['resources'][resource['name']] = {
+                'type': get_type(resource, self.logger),
+                'fingerprint': fingerprint,
+                'deployed_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'exports': dict(self.resource_exports.get(resource['name'], {}))
+            }
+            save_state(self.state_file, self.state, self.logger)
+
+    def restore_unchanged_resource(self, resource, fingerprint):
+        """Restores the exports of a resource unchanged since it was last deployed, returns True if restored."""
+        if get_type(resource, self.logger) in ('script', 'command') or resource.get('protected'):
+            # scripts and commands always run, protected exports are not recorded
+            return False
+        resource_state = self.state['resources'].get(resource['name'])
+        if not is_resource_unchanged(resource_state, fingerprint, self.incremental_ttl):
+            return False
+        exports = resource_state.get('exports', {})
+        if not get_resource_exports(resource) <= exports.keys():
+            return False
+
+        self.logger.info(
+            f"⏭️ [{resource['name']}] unchanged since it was deployed at {resource_state['deployed_at']}, "
+            f"skipping checks..."
+        )
+        with self.context_lock:
+            for key, value in exports.items():
+                self.logger.info(f"📤 set [{key}] to [{value}] from state")
+                self.global_context[key] = as_context_value(value)
+                self.resource_exports.setdefault(resource['name'], {})[key] = value
+        return True
+
+    @traced_resource('deploy resource')
+    def deploy_resource(self, resource, dry_run, show_queries):
+        if dry_run:
+            self.process_resource(resource, dry_run, show_queries)
+            return
+        # fingerprint the inputs as they are before the resource is processed
+        full_context = self.get_resource_context(resource)
+        fingerprint = get_resource_fingerprint(self.env, self.stack_dir, resource, full_context, self.logger)
+        if self.incremental_ttl is not None and self.restore_unchanged_resource(resource, fingerprint):
+            return
+        # resources skipped by their condition were not deployed, so are not recorded
+        if self.process_resource(resource, dry_run, show_queries, full_context):
+            self.save_resource_state(resource, fingerprint)
+
+    def run(
+        self, dry_run, show_queries, on_failure, output_file=None, jobs=1, state_file=None, incremental_ttl=None,
+        resource_patterns=None, include_dependents=False
+    ):
+
+        start_time = datetime.datetime.now()
+
+        self.logger.info(
+            f"deploying [{self.stack_name}] in [{self.stack_env}] environment {'(dry run)' if dry_run else ''}"
+        )
+
+        # exports are recorded in the state file as each resource is deployed, for use by teardown
+        self.state_file = get_state_file_path(self.stack_dir, self.stack_env, state_file)
+        self.state = load_state(self.state_file, self.logger) or new_state(self.stack_name, self.stack_env)
+        # resources unchanged since they were deployed within this many seconds are skipped
+        self.incremental_ttl = incremental_ttl
+
+        resources = self.manifest.get('resources', [])
+        # required resources are not deployed, only their exports are collected
+        selected, required = self.select_resources(resources, resource_patterns, include_dependents)
+        required_ids = {id(resources[index]) for index in required}
+
+        def process(resource):
+            if id(resource) in required_ids:
+                self.collect_resource_exports(resource, show_queries, dry_run)
+            else:
+                self.deploy_resource(resource, dry_run, show_queries)
+
+        def header(resource):
+            if id(resource) not in required_ids:
+                print_unicode_box(f"Processing resource: [{resource['name']}]", BorderColor.BLUE)
+
+        order = sorted(selected | required)
+        if jobs > 1:
+            self.logger.info(f"processing resources concurrently using up to {jobs} workers")
+            dependencies = get_resource_dependencies(self.env, self.stack_dir, resources, self.logger)
+            run_resource_graph(resources, dependencies, process, jobs, self.logger, order=order, header=header)
+        else:
+            for index in order:
+                header(resources[index])
+                process(resources[index])
 
         elapsed_time = datetime.datetime.now() - start_time
         self.logger.info(f"deployment completed in {elapsed_time}")
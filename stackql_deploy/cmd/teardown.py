@@ -6,211 +6,276 @@ from ..lib.utils import (
     print_unicode_box,
     BorderColor
 )
-from ..lib.config import get_full_context, render_value
-from ..lib.templating import get_queries, render_inline_template
+from ..lib.config import render_value
+from ..lib.templating import get_queries
+from ..lib.scheduler import get_resource_dependencies, reverse_dependencies, run_resource_graph
+from ..lib.context import as_context_value
+from ..lib.tracing import span, traced_resource
+from ..lib.state import get_missing_exports, get_state_file_path, load_state, remove_state, remove_resource_state
 from .base import StackQLBase
 
 class StackQLDeProvisioner(StackQLBase):
 
-    def collect_exports(self, show_queries, dry_run):
-        self.logger.info(f"collecting exports for [{self.stack_name}] in [{self.stack_env}] environment")
+    def restore_exports(self, state_file, indexes):
+        """Restores the values exported by each resource at build time from the state file.
 
-        for resource in self.manifest.get('resources', []):
-
-            type = get_type(resource, self.logger)
-
-            self.logger.info(f"getting exports for resource [{resource['name']}]")
-
-            # get full context
-            full_context = get_full_context(self.env, self.global_context, resource, self.logger)
-
-            # get resource queries
-            if type != 'command':
-                if type == 'query' and 'sql' in resource:
-                    # inline SQL specified in the resource
-                    test_queries = {}
-                    exports_query = render_inline_template(self.env,
-                                                            resource["name"],
-                                                            resource["sql"],
-                                                            full_context,
-                                                            self.logger)
-                    exports_retries = 1
-                    exports_retry_delay = 0
-                else:
-                    test_queries = get_queries(self.env,
-                                                self.stack_dir,
-                                                'resources',
-                                                resource,
-                                                full_context,
-                                                self.logger)
-                    exports_query = test_queries.get('exports', {}).get('rendered')
-                    exports_retries = test_queries.get('exports', {}).get('options', {}).get('retries', 1)
-                    exports_retry_delay = test_queries.get('exports', {}).get('options', {}).get('retry_delay', 0)
-
-            if exports_query:
-                self.process_exports(
-                    resource,
-                    full_context,
-                    exports_query,
-                    exports_retries,
-                    exports_retry_delay,
-                    dry_run,
-                    show_queries,
-                    ignore_missing_exports=True
-                )
+        Returns the indexes (of those in `indexes`) of the resources with declared exports not recorded
+        in the state file, whose exports must be collected.
+        """
+        state = load_state(state_file, self.logger)
+        if state is None:
+            catch_error_and_exit(f"state file not found: {state_file}", self.logger)
+        if state.get('stack_env') != self.stack_env:
+            catch_error_and_exit(
+                f"state file {state_file} is for environment [{state.get('stack_env')}], not [{self.stack_env}]",
+                self.logger
+            )
+        self.logger.info(f"restoring exports for [{self.stack_name}] from state file {state_file}")
+        with self.context_lock:
+            for name, resource_state in state['resources'].items():
+                for key, value in resource_state.get('exports', {}).items():
+                    self.logger.info(f"📤 set [{key}] to [{value}] from state for [{name}]")
+                    self.global_context[key] = as_context_value(value)
 
-    def run(self, dry_run, show_queries, on_failure):
+        resources = self.manifest.get('resources', [])
+        uncovered = set()
+        for index in sorted(indexes):
+            resource = resources[index]
+            missing = get_missing_exports(state, resource)
+            if not missing:
+                continue
+            uncovered.add(index)
+            if resource['name'] not in state['resources']:
+                self.logger.warning(
+                    f"[{resource['name']}] not found in state file {state_file}, collecting its exports..."
+                )
+            elif missing - set(resource.get('protected', [])):
+                self.logger.warning(
+                    f"exports {sorted(missing)} for [{resource['name']}] not found in state file {state_file}, "
+                    f"collecting its exports..."
+                )
+            else:
+                # protected exports are not recorded
+                self.logger.info(f"collecting protected exports {sorted(missing)} for [{resource['name']}]...")
+        return uncovered
 
-        start_time = datetime.datetime.now()
+    def collect_exports(self, show_queries, dry_run, jobs=1, dependencies=None, indexes=None):
+        self.logger.info(f"collecting exports for [{self.stack_name}] in [{self.stack_env}] environment")
 
-        self.logger.info(
-            f"tearing down [{self.stack_name}] in [{self.stack_env}] "
-            f"environment {'(dry run)' if dry_run else ''}"
-        )
+        resources = self.manifest.get('resources', [])
+        order = range(len(resources)) if indexes is None else sorted(indexes)
+        if jobs > 1:
+            # exports queries only wait on the resources exporting the variables they reference
+            if dependencies is None:
+                dependencies = get_resource_dependencies(self.env, self.stack_dir, resources, self.logger)
+            run_resource_graph(
+                resources,
+                dependencies,
+                lambda resource: self.collect_resource_exports(resource, show_queries, dry_run),
+                jobs,
+                self.logger,
+                order=order
+            )
+        else:
+            for index in order:
+                self.collect_resource_exports(resources[index], show_queries, dry_run)
 
-        # Collect all exports
-        self.collect_exports(show_queries, dry_run)
+    @traced_resource('deprovision resource')
+    def deprovision_resource(self, resource, dry_run, show_queries):
 
-        for resource in reversed(self.manifest['resources']):
+        type = get_type(resource, self.logger)
 
-            print_unicode_box(f"Processing resource: [{resource['name']}]", BorderColor.RED)
+        if type not in ('resource', 'multi'):
+            self.logger.debug(f"skipping resource [{resource['name']}] (type: {type})")
+            return
+        else:
+            self.logger.info(f"de-provisioning resource [{resource['name']}], type: {type}")
 
-            # process resources in reverse order
-            type = get_type(resource, self.logger)
+        # get full context
+        full_context = self.get_resource_context(resource)
 
-            if type not in ('resource', 'multi'):
-                self.logger.debug(f"skipping resource [{resource['name']}] (type: {type})")
-                continue
-            else:
-                self.logger.info(f"de-provisioning resource [{resource['name']}], type: {type}")
-
-            # get full context
-            full_context = get_full_context(self.env, self.global_context, resource, self.logger)
-
-            # Check if the resource has an 'if' condition and evaluate it
-            if 'if' in resource:
-                condition = resource['if']
-                try:
-                    # Render the condition with the full context to resolve any template variables
-                    rendered_condition = render_value(self.env, condition, full_context, self.logger)
-                    # Evaluate the condition
-                    condition_result = eval(rendered_condition)
-                    if not condition_result:
-                        self.logger.info(f"skipping resource [{resource['name']}] due to condition: {condition}")
-                        continue
-                except Exception as e:
-                    catch_error_and_exit(
-                        f"error evaluating condition for resource [{resource['name']}]: {e}",
-                        self.logger
-                    )
-
-            # add reverse export map variable to full context
-            if 'exports' in resource:
-                for export in resource['exports']:
-                    if isinstance(export, dict):
-                        for key, lookup_key in export.items():
-                            # Get the value from full_context using the lookup_key
-                            if lookup_key in full_context:
-                                # Add new mapping using the export key and looked up value
-                                full_context[key] = full_context[lookup_key]
-
-            #
-            # get resource queries
-            #
-            resource_queries = get_queries(self.env, self.stack_dir, 'resources', resource, full_context, self.logger)
-
-            exists_query = resource_queries.get('exists', {}).get('rendered')
-            exists_retries = resource_queries.get('exists', {}).get('options', {}).get('retries', 1)
-            exists_retry_delay = resource_queries.get('exists', {}).get('options', {}).get('retry_delay', 0)
-
-            if not exists_query:
-                self.logger.info(
-                    f"exists query not defined for [{resource['name']}], "
-                    f"trying to use statecheck query as exists query."
+        # Check if the resource has an 'if' condition and evaluate it
+        if 'if' in resource:
+            condition = resource['if']
+            try:
+                # Render the condition with the full context to resolve any template variables
+                rendered_condition = render_value(self.env, condition, full_context, self.logger)
+                # Evaluate the condition
+                condition_result = eval(rendered_condition)
+                if not condition_result:
+                    self.logger.info(f"skipping resource [{resource['name']}] due to condition: {condition}")
+                    return
+            except Exception as e:
+                catch_error_and_exit(
+                    f"error evaluating condition for resource [{resource['name']}]: {e}",
+                    self.logger
                 )
-                exists_query = resource_queries.get('statecheck', {}).get('rendered')
-                exists_retries = resource_queries.get('statecheck', {}).get('options', {}).get('retries', 1)
-                exists_retry_delay = resource_queries.get('statecheck', {}).get('options', {}).get('retry_delay', 0)
-                postdelete_exists_retries = resource_queries.get('statecheck', {}).get(
-                    'options', {}
-                ).get('postdelete_retries', 10)
-                postdelete_exists_retry_delay = resource_queries.get('statecheck', {}).get(
-                    'options', {}
-                ).get('postdelete_retry_delay', 5)
-            else:
-                postdelete_exists_retries = resource_queries.get('exists', {}).get(
-                    'options', {}
-                ).get('postdelete_retries', 10)
-                postdelete_exists_retry_delay = resource_queries.get('exists', {}).get(
-                    'options', {}
-                ).get('postdelete_retry_delay', 5)
-
-            delete_query = resource_queries.get('delete', {}).get('rendered')
-            delete_retries = resource_queries.get('delete', {}).get('options', {}).get('retries', 1)
-            delete_retry_delay = resource_queries.get('delete', {}).get('options', {}).get('retry_delay', 0)
-
-            if not delete_query:
-                self.logger.info(f"delete query not defined for [{resource['name']}], skipping...")
-                continue
 
-            #
-            # pre-delete check
-            #
-            ignore_errors = False
-            resource_exists = True # assume exists
-            if type == 'multi':
-                self.logger.info("pre-delete check not supported for multi resources, skipping...")
-                ignore_errors  = True # multi resources ignore errors on create or update
-            elif type == 'resource':
-                resource_exists = self.check_if_resource_exists(
-                    resource_exists,
-                    resource,
-                    full_context,
-                    exists_query,
-                    exists_retries,
-                    exists_retry_delay,
-                    dry_run,
-                    show_queries
-                )
+        # add reverse export map variable to full context
+        if 'exports' in resource:
+            for export in resource['exports']:
+                if isinstance(export, dict):
+                    for key, lookup_key in export.items():
+                        # Get the value from full_context using the lookup_key
+                        if lookup_key in full_context:
+                            # Add new mapping using the export key and looked up value
+                            full_context[key] = full_context[lookup_key]
 
-            #
-            # delete
-            #
-            if resource_exists:
-                self.delete_resource(
-                    resource,
-                    full_context,
-                    delete_query,
-                    delete_retries,
-                    delete_retry_delay,
-                    dry_run,
-                    show_queries,
-                    ignore_errors
-                )
-            else:
-                self.logger.info(f"resource [{resource['name']}] does not exist, skipping delete")
-                continue
+        #
+        # get resource queries
+        #
+        resource_queries = get_queries(self.env, self.stack_dir, 'resources', resource, full_context, self.logger)
+
+        exists_query = resource_queries.get('exists', {}).get('rendered')
+        exists_retries = resource_queries.get('exists', {}).get('options', {}).get('retries', 1)
+        exists_retry_delay = resource_queries.get('exists', {}).get('options', {}).get('retry_delay', 0)
+
+        if not exists_query:
+            self.logger.info(
+                f"exists query not defined for [{resource['name']}], "
+                f"trying to use statecheck query as exists query."
+            )
+            exists_query = resource_queries.get('statecheck', {}).get('rendered')
+            exists_retries = resource_queries.get('statecheck', {}).get('options', {}).get('retries', 1)
+            exists_retry_delay = resource_queries.get('statecheck', {}).get('options', {}).get('retry_delay', 0)
+            postdelete_exists_retries = resource_queries.get('statecheck', {}).get(
+                'options', {}
+            ).get('postdelete_retries', 10)
+            postdelete_exists_retry_delay = resource_queries.get('statecheck', {}).get(
+                'options', {}
+            ).get('postdelete_retry_delay', 5)
+        else:
+            postdelete_exists_retries = resource_queries.get('exists', {}).get(
+                'options', {}
+            ).get('postdelete_retries', 10)
+            postdelete_exists_retry_delay = resource_queries.get('exists', {}).get(
+                'options', {}
+            ).get('postdelete_retry_delay', 5)
+
+        delete_query = resource_queries.get('delete', {}).get('rendered')
+        delete_retries = resource_queries.get('delete', {}).get('options', {}).get('retries', 1)
+        delete_retry_delay = resource_queries.get('delete', {}).get('options', {}).get('retry_delay', 0)
+
+        if not delete_query:
+            self.logger.info(f"delete query not defined for [{resource['name']}], skipping...")
+            return
 
-            #
-            # confirm deletion
-            #
-            resource_deleted = self.check_if_resource_exists(
-                False,
+        #
+        # pre-delete check
+        #
+        ignore_errors = False
+        resource_exists = True # assume exists
+        if type == 'multi':
+            self.logger.info("pre-delete check not supported for multi resources, skipping...")
+            ignore_errors  = True # multi resources ignore errors on create or update
+        elif type == 'resource':
+            resource_exists = self.check_if_resource_exists(
+                resource_exists,
                 resource,
                 full_context,
                 exists_query,
-                postdelete_exists_retries,
-                postdelete_exists_retry_delay,
+                exists_retries,
+                exists_retry_delay,
+                dry_run,
+                show_queries
+            )
+
+        #
+        # delete
+        #
+        if resource_exists:
+            self.delete_resource(
+                resource,
+                full_context,
+                delete_query,
+                delete_retries,
+                delete_retry_delay,
                 dry_run,
                 show_queries,
-                delete_test=True,
+                ignore_errors
+            )
+        else:
+            self.logger.info(f"resource [{resource['name']}] does not exist, skipping delete")
+            return
+
+        #
+        # confirm deletion
+        #
+        resource_deleted = self.check_if_resource_exists(
+            False,
+            resource,
+            full_context,
+            exists_query,
+            postdelete_exists_retries,
+            postdelete_exists_retry_delay,
+            dry_run,
+            show_queries,
+            delete_test=True,
+        )
+
+        if resource_deleted:
+            self.logger.info(f"✅ successfully deleted {resource['name']}")
+        else:
+            if not dry_run:
+                catch_error_and_exit(f"❌ failed to delete {resource['name']}.", self.logger)
+
+    def run(
+        self, dry_run, show_queries, on_failure, jobs=1, from_state=False, state_file=None, resource_patterns=None,
+        include_dependents=False
+    ):
+
+        start_time = datetime.datetime.now()
+
+        self.logger.info(
+            f"tearing down [{self.stack_name}] in [{self.stack_env}] "
+            f"environment {'(dry run)' if dry_run else ''}"
+        )
+
+        resources = self.manifest['resources']
+        # only selected resources are de-provisioned, exports are collected for them and their requirements
+        selected, required = self.select_resources(resources, resource_patterns, include_dependents)
+        dependencies = None
+        if jobs > 1:
+            dependencies = get_resource_dependencies(self.env, self.stack_dir, resources, self.logger)
+
+        state_file = get_state_file_path(self.stack_dir, self.stack_env, state_file)
+        if from_state:
+            # identifiers recorded by build, exports are only collected for resources the state file doesn't cover
+            uncovered = self.restore_exports(state_file, selected | required)
+            if uncovered:
+                with span('collect stack exports'):
+                    self.collect_exports(show_queries, dry_run, jobs, dependencies, uncovered)
+        else:
+            # Collect all exports
+            with span('collect stack exports'):
+                self.collect_exports(show_queries, dry_run, jobs, dependencies, selected | required)
+
+        if jobs > 1:
+            # a resource is only deleted once every resource depending on it has been deleted
+            self.logger.info(f"de-provisioning resources concurrently using up to {jobs} workers")
+            run_resource_graph(
+                resources,
+                reverse_dependencies(dependencies),
+                lambda resource: self.deprovision_resource(resource, dry_run, show_queries),
+                jobs,
+                self.logger,
+                order=sorted(selected, reverse=True),
+                header=lambda resource: print_unicode_box(
+                    f"Processing resource: [{resource['name']}]", BorderColor.RED
+                )
             )
+        else:
+            for index in sorted(selected, reverse=True):
+                resource = resources[index]
+                print_unicode_box(f"Processing resource: [{resource['name']}]", BorderColor.RED)
+                self.deprovision_resource(resource, dry_run, show_queries)
 
-            if resource_deleted:
-                self.logger.info(f"✅ successfully deleted {resource['name']}")
+        # recorded exports no longer apply to resources which have been torn down
+        if not dry_run:
+            if resource_patterns:
+                remove_resource_state(state_file, [resources[index]['name'] for index in selected], self.logger)
             else:
-                if not dry_run:
-                    catch_error_and_exit(f"❌ failed to delete {resource['name']}.", self.logger)
+                remove_state(state_file, self.logger)
 
         elapsed_time = datetime.datetime.now() - start_time
         self.logger.info(f"deployment completed in {elapsed_time}")
@@ -0,0 +1,80 @@
+# lib/binary.py
+import contextlib
+import json
+import os
+import threading
+
+BINARY_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.stackql-deploy', 'cache', 'binary.json')
+
+_lock = threading.Lock()
+
+def get_binary_signature(bin_path):
+    """Returns the key version info is cached under, a replaced or upgraded binary has a new signature."""
+    stat = os.stat(bin_path)
+    return f"{os.path.realpath(bin_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+
+def _load_cache():
+    try:
+        with open(BINARY_CACHE_FILE, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def _save_cache(cache, logger):
+    try:
+        os.makedirs(os.path.dirname(BINARY_CACHE_FILE), exist_ok=True)
+        tmp_path = f"{BINARY_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, BINARY_CACHE_FILE)
+    except OSError as e:
+        # the cache is an optimization, the version is probed again next time
+        logger.debug(f"(binary._save_cache) unable to write {BINARY_CACHE_FILE}: {str(e)}")
+
+def get_cached_binary_version(bin_path, get_binary_version, logger):
+    """Returns the (version, sha) of the stackql binary, running `stackql --version` only for a new binary."""
+    try:
+        signature = get_binary_signature(bin_path)
+    except OSError:
+        return get_binary_version(bin_path)
+
+    with _lock:
+        cache = _load_cache()
+        cached = cache.get(signature)
+        if isinstance(cached, list) and len(cached) == 2:
+            logger.debug(f"(binary.get_cached_binary_version) using cached version info for {bin_path}")
+            return tuple(cached)
+
+        version, sha = get_binary_version(bin_path)
+        # entries for previous binaries at the same path are dropped
+        real_path = signature.rsplit(':', 2)[0]
+        cache = {key: value for key, value in cache.items() if key.rsplit(':', 2)[0] != real_path}
+        cache[signature] = [version, sha]
+        _save_cache(cache, logger)
+        logger.debug(f"(binary.get_cached_binary_version) cached version info for {bin_path}: {version} ({sha})")
+        return version, sha
+
+@contextlib.contextmanager
+def cached_binary_version(logger):
+    """Serves the binary version probe run when a StackQL instance is created from the version cache.
+
+    pystackql runs `stackql --version` in a subprocess every time an instance is created, this is
+    replaced by a lookup keyed on the binary's path, size and modification time.  If pystackql's
+    layout is not as expected, the probe is left as-is.
+    """
+    try:
+        from pystackql.core import binary as pystackql_binary
+        get_binary_version = pystackql_binary.get_binary_version
+    except (ImportError, AttributeError):
+        yield
+        return
+
+    def _get_binary_version(bin_path):
+        return get_cached_binary_version(bin_path, get_binary_version, logger)
+
+    pystackql_binary.get_binary_version = _get_binary_version
+    try:
+        yield
+    finally:
+        pystackql_binary.get_binary_version = get_binary_version
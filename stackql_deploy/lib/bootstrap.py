@@ -1,8 +1,52 @@
 # lib/bootstrap.py
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
 # Set up logging at the root level
 logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    format=LOG_FORMAT
 )
 logger = logging.getLogger("stackql-deploy")
+
+# records are written to stderr by a listener thread, so logging never waits on the terminal,
+# messages are still formatted by the thread logging them
+_log_queue = queue.Queue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+_log_listener = QueueListener(_log_queue, _log_handler)
+logger.addHandler(QueueHandler(_log_queue))
+logger.propagate = False
+_log_listener.start()
+
+def _stop_listener():
+    global _log_listener
+    listener, _log_listener = _log_listener, None
+    # writes any records still queued
+    listener.stop()
+
+atexit.register(_stop_listener)
+
+def flush_logs():
+    """Waits until queued log records have been written, call before writing to the terminal directly."""
+    if _log_listener is not None:
+        _log_queue.join()
+
+class lazy_format:
+    """Log record argument which calls `func(*args, **kwargs)` only if the record is emitted.
+
+    e.g. `logger.debug("context:\\n%s", lazy_format(pprint.pformat, context))`
+    """
+
+    __slots__ = ('func', 'args', 'kwargs')
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
@@ -0,0 +1,139 @@
+# lib/bundle.py
+import datetime
+import json
+import marshal
+import os
+import sys
+import jinja2
+from jinja2 import TemplateError
+from .utils import catch_error_and_exit
+from .config import load_manifest
+from .filters import get_template_key
+from .templating import load_sql_queries
+
+BUNDLE_FORMAT = 'stackql-deploy-bundle'
+BUNDLE_VERSION = 1
+
+def is_bundle(path):
+    """Stacks are directories, a file is treated as a bundle."""
+    return os.path.isfile(path)
+
+def get_bundle_file_path(stack_dir):
+    return f"{os.path.normpath(stack_dir)}.bundle"
+
+def _collect_strings(value, strings):
+    if isinstance(value, str):
+        strings.add(value)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _collect_strings(item, strings)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_strings(item, strings)
+
+def create_bundle(env, stack_dir, output_file, logger):
+    """Writes a bundle containing the parsed manifest, the parsed query files and compiled templates.
+
+    The bundle is a JSON header line followed by two marshalled sections, the stack data and the
+    compiled template code.  Template code is only valid for the Python and Jinja versions which
+    compiled it, these are recorded in the header.
+    """
+    manifest = load_manifest(stack_dir, logger)
+
+    query_files = {}
+    resources_dir = os.path.join(stack_dir, 'resources')
+    for root, _, files in os.walk(resources_dir):
+        for name in sorted(files):
+            if name.endswith('.iql'):
+                path = os.path.join(root, name)
+                relative_path = os.path.relpath(path, resources_dir).replace(os.sep, '/')
+                query_files[relative_path] = load_sql_queries(path, logger)
+
+    # manifest values are rendered as templates along with every query anchor
+    sources = set()
+    _collect_strings(manifest.get('globals', []), sources)
+    _collect_strings(manifest.get('resources', []), sources)
+    for queries, _ in query_files.values():
+        sources.update(queries.values())
+    templates = {}
+    for source in sources:
+        try:
+            templates[get_template_key(source)] = env.compile(source)
+        except TemplateError as e:
+            # reported when the template is rendered
+            logger.debug(f"(bundle.create_bundle) unable to compile template, skipping: {str(e)}")
+
+    try:
+        data = marshal.dumps({'manifest': manifest, 'query_files': query_files})
+        code = marshal.dumps(templates)
+    except ValueError as e:
+        catch_error_and_exit(f"(bundle.create_bundle) manifest contains unsupported values: {str(e)}", logger)
+
+    header = {
+        'format': BUNDLE_FORMAT,
+        'version': BUNDLE_VERSION,
+        'stack_name': manifest.get('name', stack_dir),
+        'stack_dir': os.path.normpath(stack_dir),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': sys.implementation.cache_tag,
+        'jinja2': jinja2.__version__,
+        'data_size': len(data),
+    }
+    try:
+        dest_dir = os.path.dirname(output_file)
+        if dest_dir:
+            os.makedirs(dest_dir, exist_ok=True)
+        tmp_path = f"{output_file}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            f.write(data)
+            f.write(code)
+        os.replace(tmp_path, output_file)
+    except OSError as e:
+        catch_error_and_exit(f"(bundle.create_bundle) failed to write bundle {output_file}: {e}", logger)
+
+    logger.info(
+        f"📦 bundled {len(query_files)} query files and {len(templates)} compiled templates to {output_file}"
+    )
+    return header
+
+def load_bundle(path, logger):
+    """Loads a bundle, returns its header along with the manifest, query files and compiled templates."""
+    try:
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline())
+            payload = f.read()
+    except (OSError, ValueError) as e:
+        catch_error_and_exit(f"(bundle.load_bundle) {path} is not a stackql-deploy bundle: {e}", logger)
+    if not isinstance(header, dict) or header.get('format') != BUNDLE_FORMAT:
+        catch_error_and_exit(f"(bundle.load_bundle) {path} is not a stackql-deploy bundle", logger)
+    if header.get('version') != BUNDLE_VERSION:
+        catch_error_and_exit(
+            f"(bundle.load_bundle) unsupported bundle version {header.get('version')} in {path}, "
+            f"recreate it using this version of stackql-deploy",
+            logger
+        )
+
+    try:
+        data = marshal.loads(payload[:header['data_size']])
+        templates = {}
+        if header['python'] == sys.implementation.cache_tag and header['jinja2'] == jinja2.__version__:
+            templates = marshal.loads(payload[header['data_size']:])
+        else:
+            logger.warning(
+                f"bundle {path} was created with {header['python']} and jinja2 {header['jinja2']}, "
+                f"templates will be compiled at runtime"
+            )
+    except (EOFError, ValueError, TypeError, KeyError) as e:
+        catch_error_and_exit(f"(bundle.load_bundle) {path} is corrupt: {str(e)}", logger)
+
+    logger.debug(
+        f"(bundle.load_bundle) loaded [{header['stack_name']}] bundle created {header['created']} with "
+        f"{len(data['query_files'])} query files and {len(templates)} compiled templates"
+    )
+    return {
+        **header,
+        'manifest': data['manifest'],
+        'query_files': data['query_files'],
+        'templates': templates,
+    }
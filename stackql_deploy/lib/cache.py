@@ -0,0 +1,113 @@
+# lib/cache.py
+import copy
+import json
+import re
+import threading
+
+# provider of the resources targeted by a statement, e.g. `aws` for `INSERT INTO aws.ec2.vpcs` or
+# `google` for `EXEC google.compute.instances.start`
+WRITE_TARGET_PATTERN = re.compile(
+    r'\b(?:INTO|UPDATE|FROM|REPLACE|EXEC)\s+(?:/\*.*?\*/\s*)?([A-Za-z_]\w*)\.\w+\.\w+',
+    re.IGNORECASE | re.DOTALL
+)
+
+def get_write_targets(command):
+    """Returns the set of providers whose resources are written by a stackql statement.
+
+    Invalidation is scoped to the provider rather than the resource, as resources are commonly
+    checked through a different resource than the one they are created with (for example
+    `aws.ec2.vpcs` is checked using `aws.ec2.vpc_tags`).
+    """
+    return {target.lower() for target in WRITE_TARGET_PATTERN.findall(command)}
+
+def is_cacheable(result):
+    """Error results are never cached."""
+    if not isinstance(result, list):
+        return False
+    return not any(isinstance(row, dict) and 'error' in row for row in result)
+
+class QueryCache:
+    """Run-scoped cache of stackql query results.
+
+    Results are keyed on the rendered query along with any custom auth, concurrent requests for
+    the same key are collapsed into a single call (single-flight).  Entries are invalidated when a
+    statement writes to a provider they read from, a statement whose target can't be determined
+    clears the cache.  Only the first check of a poll is served from the cache, retries always
+    reach the provider.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self._results = {}
+        self._inflight = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query, custom_auth=None, env_vars=None):
+        return (
+            query.strip(),
+            json.dumps(custom_auth, sort_keys=True, default=str) if custom_auth else None,
+            json.dumps(env_vars, sort_keys=True, default=str) if env_vars else None,
+        )
+
+    def get_or_run(self, query, run, custom_auth=None, env_vars=None):
+        """Returns the cached result for a query, calling `run()` to populate it on a miss."""
+        key = self.make_key(query, custom_auth, env_vars)
+        while True:
+            with self._lock:
+                if key in self._results:
+                    self.hits += 1
+                    self.logger.debug("(cache.QueryCache.get_or_run) cache hit for query")
+                    return copy.deepcopy(self._results[key])
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    generation = self._generation
+                    self.misses += 1
+                    break
+            # an identical query is in flight, wait for it and check again
+            event.wait()
+
+        result = None
+        try:
+            result = run()
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                # results which may have been overtaken by a write are not stored
+                if generation == self._generation and is_cacheable(result):
+                    self._results[key] = copy.deepcopy(result)
+            event.set()
+
+    def discard(self, query, custom_auth=None, env_vars=None):
+        """Removes the entry for a query, used so retries and polls always reach the provider."""
+        with self._lock:
+            self._results.pop(self.make_key(query, custom_auth, env_vars), None)
+
+    def invalidate(self, command):
+        """Removes entries which read from any provider written to by `command`."""
+        targets = get_write_targets(command)
+        with self._lock:
+            self._generation += 1
+            if not targets:
+                self.logger.debug("(cache.QueryCache.invalidate) unable to determine write target, clearing cache")
+                self._results.clear()
+                return
+            pattern = re.compile(
+                r'\b(?:' + '|'.join(re.escape(target) for target in targets) + r')\.\w+\.\w+', re.IGNORECASE
+            )
+            stale = [key for key in self._results if pattern.search(key[0])]
+            for key in stale:
+                del self._results[key]
+        self.logger.debug(
+            f"(cache.QueryCache.invalidate) invalidated {len(stale)} entries for {sorted(targets)}"
+        )
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._results.clear()
@@ -0,0 +1,112 @@
+# lib/coalesce.py
+import json
+import re
+import threading
+import time
+
+# existence and state checks which return a single `count` column
+PROBE_PATTERN = re.compile(r'^\s*SELECT\s+COUNT\s*\(\s*\*\s*\)\s+(?:AS\s+)?count\s+FROM\b', re.IGNORECASE)
+PROVIDER_PATTERN = re.compile(r'\bFROM\s+([A-Za-z_]\w*)\.\w+\.\w+', re.IGNORECASE)
+
+def is_count_probe(query):
+    return bool(PROBE_PATTERN.match(query))
+
+def get_probe_key(query, custom_auth=None, env_vars=None):
+    """Probes can be combined if they use the same auth and read from the same providers."""
+    providers = sorted({provider.lower() for provider in PROVIDER_PATTERN.findall(query)})
+    return (
+        tuple(providers),
+        json.dumps(custom_auth, sort_keys=True, default=str) if custom_auth else None,
+        json.dumps(env_vars, sort_keys=True, default=str) if env_vars else None,
+    )
+
+def build_batch_query(queries):
+    """Combines count probes into a single query returning a `probe_tag` and `count` row per probe."""
+    return "\nUNION ALL\n".join(
+        f"SELECT '{tag}' AS probe_tag, count FROM (\n{query.strip().rstrip(';')}\n) AS probe_{tag}"
+        for tag, query in queries
+    )
+
+class _Batch:
+    def __init__(self):
+        self.probes = []
+        self.results = None
+        self.done = threading.Event()
+
+class ProbeCoalescer:
+    """Wraps a StackQL instance, combining count probes issued concurrently into batched queries.
+
+    Probes arriving within `window` seconds of each other with the same auth and providers are run
+    as a single `UNION ALL` query, the per-probe counts are then returned to each caller.  If the
+    batched query fails, each probe is run individually.  All other calls are passed through.
+    """
+
+    def __init__(self, stackql, logger, window=0.1, max_batch=25):
+        self.stackql = stackql
+        self.logger = logger
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.stackql, name)
+
+    def execute(self, query, suppress_errors=True, custom_auth=None, env_vars=None, **kwargs):
+        if not is_count_probe(query):
+            return self.stackql.execute(
+                query, suppress_errors=suppress_errors, custom_auth=custom_auth, env_vars=env_vars, **kwargs
+            )
+
+        key = get_probe_key(query, custom_auth, env_vars)
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._pending[key] = _Batch()
+            index = len(batch.probes)
+            batch.probes.append(query)
+            if len(batch.probes) >= self.max_batch:
+                # full, later probes start a new batch
+                self._pending.pop(key, None)
+
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            try:
+                batch.results = self._run_batch(batch.probes, custom_auth, env_vars)
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.results is None:
+            return self.stackql.execute(
+                query, suppress_errors=suppress_errors, custom_auth=custom_auth, env_vars=env_vars, **kwargs
+            )
+        return batch.results[index]
+
+    def _run_batch(self, probes, custom_auth, env_vars):
+        """Returns the result for each probe, or None if they should be run individually."""
+        if len(probes) == 1:
+            return None
+        tagged = [(f"p{index}", query) for index, query in enumerate(probes)]
+        self.logger.debug(f"(coalesce.ProbeCoalescer) running {len(probes)} probes as a single query")
+        try:
+            rows = self.stackql.execute(
+                build_batch_query(tagged), suppress_errors=True, custom_auth=custom_auth, env_vars=env_vars
+            )
+        except Exception as e:
+            self.logger.debug(f"(coalesce.ProbeCoalescer) batched probes failed, running individually: {str(e)}")
+            return None
+        if not isinstance(rows, list) or any(not isinstance(row, dict) or 'error' in row for row in rows):
+            self.logger.debug(f"(coalesce.ProbeCoalescer) batched probes failed, running individually: {rows}")
+            return None
+
+        counts = {row.get('probe_tag'): row.get('count') for row in rows}
+        if any(tag not in counts for tag, _ in tagged):
+            self.logger.debug("(coalesce.ProbeCoalescer) incomplete batched probe results, running individually")
+            return None
+        return [[{'count': counts[tag]}] for tag, _ in tagged]
@@ -4,9 +4,15 @@ import yaml
 import json
 import pprint
 import sys
-from .utils import pull_providers, catch_error_and_exit
+import threading
+from .utils import catch_error_and_exit
+from .bootstrap import lazy_format
+from .tracing import span
+from .providers import install_providers
 from jinja2 import TemplateError
 from .filters import merge_lists, merge_objects
+from .context import as_context_value, loads, new_scope, render_template
+from .scheduler import get_prop_references
 
 def to_sql_compatible_json(value):
     """
@@ -19,6 +25,8 @@ def to_sql_compatible_json(value):
     - json string -> json string
     - boolean -> boolean (true, false are returned as is)
 
+    Strings are returned as ContextValues, which cache their parsed and query forms.
+
     Args:
         value: The Python object to be converted.
 
@@ -30,17 +38,12 @@ def to_sql_compatible_json(value):
         return value
 
     if isinstance(value, str):
-        try:
-            # Try to load the string as JSON to see if it's already a valid JSON string
-            json.loads(value)
-            return value  # It's a valid JSON string, return as-is
-        except ValueError:
-            # It's not a valid JSON string, so return it as a string
-            return value
+        # JSON strings and plain strings are both returned as-is
+        return as_context_value(value)
 
     if isinstance(value, (dict, list)):
         # Convert dicts and lists to JSON strings
-        return json.dumps(value)
+        return as_context_value(json.dumps(value))
 
     # If the value doesn't match any of the above types, return it as-is
     return value
@@ -49,7 +52,7 @@ def render_value(env, value, context, logger):
     if isinstance(value, str):
         try:
             template = env.from_string(value)
-            rendered = template.render(**context)
+            rendered = render_template(template, context)
             if rendered in ['True', 'False']:
                 return rendered.replace('True', 'true').replace('False', 'false')
             return rendered
@@ -68,11 +71,9 @@ def render_globals(env, vars, global_vars, stack_env, stack_name, logger):
     global_context = {'stack_env': stack_env, 'stack_name': stack_name}
 
     logger.debug("(config.render_globals) rendering global variables...")
-    # Now render each global variable using the combined context of env vars and the current global context
+    # Globals are rendered from the global context layered over the env vars, this sees each global as it is added
+    combined_context = new_scope(global_context, vars)
     for global_var in global_vars:
-        # Merge global_context with vars to create a complete context for rendering
-        combined_context = {**vars, **global_context}
-
         # Render using the combined context
         rendered_value = render_value(env, global_var['value'], combined_context, logger)
 
@@ -80,46 +81,43 @@ def render_globals(env, vars, global_vars, stack_env, stack_name, logger):
             raise ValueError(f"(config.render_globals) global variable '{global_var['name']}' cannot be empty.")
 
         # Update the context with the rendered global variable
+        global_context[global_var['name']] = to_sql_compatible_json(rendered_value)
         logger.debug(
-            f"(config.render_globals) setting global variable [{global_var['name']}] to "
-            f"{to_sql_compatible_json(rendered_value)}"
+            "(config.render_globals) setting global variable [%s] to %s",
+            global_var['name'],
+            global_context[global_var['name']]
         )
-        global_context[global_var['name']] = to_sql_compatible_json(rendered_value)
 
     return global_context
 
 def render_properties(env, resource_props, global_context, logger):
     prop_context = {}
-    # Create a resource_context that starts with a copy of global_context
-    # This will be used for rendering and updated as we go, but not returned
-    resource_context = global_context.copy()
+    # Props are rendered from a resource_context layering the props processed so far over global_context
+    resource_context = new_scope(prop_context, global_context)
 
     logger.debug("rendering properties...")
     for prop in resource_props:
         try:
             if 'value' in prop:
                 # Use resource_context for rendering, which includes both global vars and
-                # properties that have already been processed
+                # properties that have already been processed (as prop_context is its first layer)
                 rendered_value = render_value(env, prop['value'], resource_context, logger)
+                prop_context[prop['name']] = to_sql_compatible_json(rendered_value)
                 logger.debug(
-                    f"(config.render_properties) setting property [{prop['name']}] to "
-                    f"{to_sql_compatible_json(rendered_value)}"
+                    "(config.render_properties) setting property [%s] to %s", prop['name'], prop_context[prop['name']]
                 )
-                prop_context[prop['name']] = to_sql_compatible_json(rendered_value)
-                # Update resource_context with the new property
-                resource_context[prop['name']] = to_sql_compatible_json(rendered_value)
             elif 'values' in prop:
                 env_value = prop['values'].get(global_context['stack_env'], {}).get('value')
                 if env_value is not None:
                     # Use resource_context for rendering
                     rendered_value = render_value(env, env_value, resource_context, logger)
+                    prop_context[prop['name']] = to_sql_compatible_json(rendered_value)
                     logger.debug(
-                        f"(config.render_properties) setting property [{prop['name']}] using value for "
-                        f"{env_value} to {to_sql_compatible_json(rendered_value)}"
+                        "(config.render_properties) setting property [%s] using value for %s to %s",
+                        prop['name'],
+                        env_value,
+                        prop_context[prop['name']]
                     )
-                    prop_context[prop['name']] = to_sql_compatible_json(rendered_value)
-                    # Update resource_context with the new property
-                    resource_context[prop['name']] = to_sql_compatible_json(rendered_value)
                 else:
                     catch_error_and_exit(
                         f"(config.render_properties) no value specified for property '{prop['name']}' "
@@ -130,21 +128,26 @@ def render_properties(env, resource_props, global_context, logger):
             if 'merge' in prop:
                 logger.debug(f"(config.render_properties) processing merge for [{prop['name']}]")
                 base_value_rendered = prop_context.get(prop['name'], None)
-                base_value = json.loads(base_value_rendered) if base_value_rendered else None
+                base_value = loads(base_value_rendered) if base_value_rendered else None
                 base_value_type = type(base_value)
                 logger.debug(
-                    f"(config.render_properties) base value for [{prop['name']}]: "
-                    f"{base_value_rendered} (type: {base_value_type})"
+                    "(config.render_properties) base value for [%s]: %s (type: %s)",
+                    prop['name'],
+                    base_value_rendered,
+                    base_value_type
                 )
                 for merge_item in prop['merge']:
                     # Use resource_context for lookups during merge
                     if merge_item in resource_context:
                         merge_value_rendered = resource_context[merge_item]
-                        merge_value = json.loads(merge_value_rendered)
+                        merge_value = loads(merge_value_rendered)
                         merge_value_type = type(merge_value)
                         logger.debug(
-                            f"(config.render_properties) [{prop['name']}] merge value [{merge_item}]: "
-                            f"{merge_value_rendered} (type: {merge_value_type})"
+                            "(config.render_properties) [%s] merge value [%s]: %s (type: %s)",
+                            prop['name'],
+                            merge_item,
+                            merge_value_rendered,
+                            merge_value_type
                         )
 
                         # Determine if we're merging lists or objects
@@ -177,14 +180,44 @@ def render_properties(env, resource_props, global_context, logger):
 
                 processed_value = to_sql_compatible_json(base_value)
                 prop_context[prop['name']] = processed_value
-                # Update resource_context with the merged property
-                resource_context[prop['name']] = processed_value
 
         except Exception as e:
             catch_error_and_exit(f"(config.render_properties) failed to render property '{prop['name']}']: {e}", logger)
 
     return prop_context
 
+class PropContextCache:
+    """Memoizes the rendered props of each resource for a run.
+
+    Rendered props are keyed on the values of the context variables they reference, so they are
+    only rendered again (e.g. when a resource is visited by both export collection and teardown)
+    if one of these has changed since, such as an export from an upstream resource.
+    """
+
+    def __init__(self, env, logger):
+        self.env = env
+        self.logger = logger
+        self._references = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_prop_context(self, global_context, resource):
+        key = id(resource)
+        with self._lock:
+            references = self._references.get(key)
+            if references is None:
+                references = self._references[key] = sorted(get_prop_references(self.env, resource))
+            inputs = [global_context.get(var) for var in references]
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == inputs:
+                self.logger.debug(f"(config.PropContextCache) using rendered props for [{resource['name']}]")
+                return entry[1]
+
+        prop_context = render_properties(self.env, resource.get('props', {}), global_context, self.logger)
+        with self._lock:
+            self._entries[key] = (inputs, prop_context)
+        return prop_context
+
 #
 # exported functions
 #
@@ -198,14 +231,19 @@ def load_manifest(stack_dir, logger):
     except Exception as e:
         catch_error_and_exit("(config.load_manifest) failed to load manifest: " + str(e), logger)
 
-def get_global_context_and_providers(env, manifest, vars, stack_env, stack_name, stackql, logger):
+def get_global_context_and_providers(
+    env, manifest, vars, stack_env, stack_name, stackql, logger, stack_dir, refresh_providers=False,
+    update_providers_lock=False
+):
     # Extract the global variables from the manifest and include stack_env
     logger.debug("(config.get_global_context_and_providers) getting global context and pulling providers...")
     try:
         global_vars = manifest.get('globals', [])
-        global_context = render_globals(env, vars, global_vars, stack_env, stack_name, logger)
+        with span('render globals'):
+            global_context = render_globals(env, vars, global_vars, stack_env, stack_name, logger)
         providers = manifest.get('providers', [])
-        pull_providers(providers, stackql, logger)
+        with span('install providers', {'stackql_deploy.providers': ', '.join(providers)}):
+            install_providers(providers, stack_dir, stackql, logger, refresh_providers, update_providers_lock)
         return global_context, providers
     except Exception as e:
         catch_error_and_exit(
@@ -213,15 +251,31 @@ def get_global_context_and_providers(env, manifest, vars, stack_env, stack_name,
             logger
         )
 
-def get_full_context(env, global_context, resource, logger):
+def get_full_context(env, global_context, resource, logger, prop_context_cache=None, references=None):
+    """Returns the context a resource is processed with, layered over its props and the global context.
+
+    The values of the `references` globals are copied into the context, the caller holds the context
+    lock, so values exported by resources processed concurrently don't change while it is processed.
+    """
     logger.debug(f"(config.get_full_context) getting full context for {resource['name']}...")
     try:
-        resource_props = resource.get('props', {})
-        prop_context = render_properties(env, resource_props, global_context, logger)
-        full_context = {**global_context, **prop_context}
+        with span('render context', {'stackql_deploy.resource': resource.get('name')}):
+            if prop_context_cache is not None:
+                prop_context = prop_context_cache.get_prop_context(global_context, resource)
+            else:
+                resource_props = resource.get('props', {})
+                prop_context = render_properties(env, resource_props, global_context, logger)
+        referenced_globals = {} if references is None else {
+            name: global_context[name] for name in references if name in global_context
+        }
+        # variables set while processing the resource are written to its own layer, leaving the props
+        # (which are shared by later visits) and the global context unchanged
+        full_context = new_scope({}, prop_context, referenced_globals, global_context)
 
-        formatted_context = pprint.pformat(full_context, indent=1, width=sys.maxsize)
-        logger.debug(f"(config.get_full_context) full context:\n{formatted_context}")
+        logger.debug(
+            "(config.get_full_context) full context:\n%s",
+            lazy_format(lambda: pprint.pformat(dict(full_context), indent=1, width=sys.maxsize))
+        )
 
         return full_context
     except Exception as e:
@@ -0,0 +1,116 @@
+# lib/context.py
+import json
+from collections import ChainMap
+from collections.abc import Mapping
+
+_UNSET = object()
+
+def to_query_value(value):
+    """Returns a context value in the form it is substituted into queries.
+
+    Strings holding JSON objects or arrays are re-serialized compactly with lower case booleans,
+    other values are returned as-is.
+    """
+    if isinstance(value, ContextValue):
+        return value.query_value
+    if isinstance(value, str):
+        return _serialize_for_query(value)
+    return value
+
+def _serialize_for_query(value):
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return value
+    if not isinstance(parsed, (dict, list)):
+        return value
+    # Serialize JSON ensuring booleans are lower case and using correct JSON syntax
+    return json.dumps(
+        parsed, ensure_ascii=False, separators=(',', ':')
+    ).replace('True', 'true').replace('False', 'false')
+
+class ContextValue(str):
+    """String value of a global, prop or export in the template context.
+
+    Values are parsed as JSON at most once and the form substituted into queries is computed
+    once, rather than on every render.  As a `str` subclass, values can be used anywhere the
+    plain string was.
+    """
+
+    def __new__(cls, value):
+        instance = super().__new__(cls, value)
+        instance._parsed = _UNSET
+        instance._query_value = _UNSET
+        return instance
+
+    def loads(self):
+        """Returns the value parsed as JSON, raising ValueError if it is not valid JSON."""
+        if self._parsed is _UNSET:
+            try:
+                self._parsed = (json.loads(self), None)
+            except ValueError as e:
+                self._parsed = (None, str(e))
+        parsed, error = self._parsed
+        if error is not None:
+            raise ValueError(error)
+        return parsed
+
+    @property
+    def query_value(self):
+        if self._query_value is _UNSET:
+            self._query_value = _serialize_for_query(self)
+        return self._query_value
+
+def as_context_value(value):
+    """Wraps string values as ContextValues, other values are returned as-is."""
+    if isinstance(value, str) and not isinstance(value, ContextValue):
+        return ContextValue(value)
+    return value
+
+def loads(value):
+    """Parses a JSON context value, using the cached parse for ContextValues."""
+    if isinstance(value, ContextValue):
+        return value.loads()
+    return json.loads(value)
+
+class QueryScope(Mapping):
+    """Read-only view of a context with values in the form they are substituted into queries.
+
+    Values are converted as templates look them up, rather than converting a copy of the whole
+    context for each render.
+    """
+
+    def __init__(self, scope):
+        self.scope = scope
+
+    def __getitem__(self, key):
+        return to_query_value(self.scope[key])
+
+    def __contains__(self, key):
+        return key in self.scope
+
+    def __iter__(self):
+        return iter(self.scope)
+
+    def __len__(self):
+        return len(self.scope)
+
+def new_scope(*layers):
+    """Returns a context made up of layers, e.g. (props, global context, env vars).
+
+    Variables are looked up in each layer in turn and writes go to the first layer, so a resource
+    context is built without copying the contexts beneath it.
+    """
+    return ChainMap(*layers)
+
+def render_template(template, scope):
+    """Renders a template from a context mapping.
+
+    `Template.render` copies the context into a new dict on every call, here the mapping is used
+    directly (with the environment globals beneath it) as the parent of the render context.
+    """
+    context = template.new_context(ChainMap(scope, template.globals), shared=True)
+    try:
+        return template.environment.concat(template.root_render_func(context))
+    except Exception:
+        template.environment.handle_exception()
@@ -2,10 +2,22 @@
 import os
 import json
 import base64
+import hashlib
 import uuid
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+from jinja2.utils import LRUCache
 from .utils import catch_error_and_exit
 
+# compiled templates are persisted here so repeated runs skip template compilation
+TEMPLATE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.stackql-deploy', 'cache', 'templates')
+
+# overrides the template cache directory, `off` (or empty) keeps compiled templates in memory only
+TEMPLATE_CACHE_DIR_ENV = 'STACKQL_DEPLOY_TEMPLATE_CACHE'
+TEMPLATE_CACHE_DISABLED = ('', 'off', 'false', '0', 'none')
+
+# compiled templates kept in the template cache directory, the least recently written are removed
+TEMPLATE_CACHE_MAX_ENTRIES = 2048
+
 def from_json(value):
     return json.loads(value)
 
@@ -126,17 +138,106 @@ def sql_escape(value):
 
     return value.replace("'", "''")
 
+def get_template_key(source):
+    return hashlib.sha256(source.encode()).hexdigest()
+
+class CachingEnvironment(Environment):
+    """Jinja environment which caches templates compiled from strings.
+
+    Queries, props and inline templates are rendered with `from_string`, which compiles the source
+    on every call.  Compiled templates are kept in an LRU cache keyed by a hash of their source, and
+    the compiled code is stored in the bytecode cache (if configured) for use by later runs.  Code
+    in `compiled_templates` (e.g. from a bundle) is used without compiling.
+    """
+
+    def __init__(self, *args, template_cache_size=1024, compiled_templates=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.string_templates = LRUCache(template_cache_size)
+        self.compiled_templates = compiled_templates or {}
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals or template_class is not None or not isinstance(source, str):
+            return super().from_string(source, globals, template_class)
+        key = get_template_key(source)
+        template = self.string_templates.get(key)
+        if template is None:
+            template = self.template_class.from_code(self, self._compile_string(key, source), self.make_globals(None))
+            self.string_templates[key] = template
+        return template
+
+    def _compile_string(self, key, source):
+        if key in self.compiled_templates:
+            return self.compiled_templates[key]
+        bucket = None
+        if self.bytecode_cache is not None:
+            bucket = self.bytecode_cache.get_bucket(self, key, None, source)
+            if bucket.code is not None:
+                return bucket.code
+        code = self.compile(source)
+        if bucket is not None:
+            bucket.code = code
+            try:
+                self.bytecode_cache.set_bucket(bucket)
+            except OSError:
+                # the cache is an optimization, an unwritable cache directory is not an error
+                pass
+        return code
+
+def get_template_cache_dir():
+    """Returns the template cache directory, or None if the persistent template cache is disabled."""
+    cache_dir = os.environ.get(TEMPLATE_CACHE_DIR_ENV)
+    if cache_dir is None:
+        return TEMPLATE_CACHE_DIR
+    if cache_dir.strip().lower() in TEMPLATE_CACHE_DISABLED:
+        return None
+    return os.path.expanduser(cache_dir)
+
+def prune_template_cache(cache_dir, logger, max_entries=TEMPLATE_CACHE_MAX_ENTRIES):
+    """Removes the least recently written compiled templates beyond `max_entries`."""
+    try:
+        entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith('.cache')]
+        if len(entries) <= max_entries:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+        for entry in entries[:len(entries) - max_entries]:
+            os.remove(entry.path)
+    except OSError as e:
+        logger.debug(f"(config.prune_template_cache) unable to prune {cache_dir}: {str(e)}")
+        return
+    logger.debug(f"(config.prune_template_cache) removed {len(entries) - max_entries} templates from {cache_dir}")
+
+def get_bytecode_cache(logger):
+    """Returns the persistent template cache, None (compiled templates are only cached in memory) if it is
+    disabled or the cache directory can't be written."""
+    cache_dir = get_template_cache_dir()
+    if cache_dir is None:
+        logger.debug("(config.get_bytecode_cache) template cache disabled")
+        return None
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError as e:
+        logger.debug(f"(config.get_bytecode_cache) template cache disabled: {str(e)}")
+        return None
+    if not os.access(cache_dir, os.W_OK):
+        logger.debug(f"(config.get_bytecode_cache) template cache disabled: {cache_dir} is not writable")
+        return None
+    prune_template_cache(cache_dir, logger)
+    return FileSystemBytecodeCache(cache_dir)
+
 #
 # exported functions
 #
 
-def setup_environment(stack_dir, logger):
+def setup_environment(stack_dir, logger, compiled_templates=None):
     logger.debug("(config.setup_environment) setting up environment...")
-    if not os.path.exists(stack_dir):
+    # bundled stacks don't require the stack directory
+    if compiled_templates is None and not os.path.exists(stack_dir):
         catch_error_and_exit("(config.setup_environment) stack directory does not exist.", logger)
-    env = Environment(
+    env = CachingEnvironment(
         loader=FileSystemLoader(os.getcwd()),
-        autoescape=False
+        autoescape=False,
+        bytecode_cache=get_bytecode_cache(logger),
+        compiled_templates=compiled_templates
     )
     env.filters['from_json'] = from_json
     env.filters['base64_encode'] = base64_encode
@@ -0,0 +1,148 @@
+# lib/providers.py
+import hashlib
+import json
+import os
+import re
+from .utils import pull_providers, run_stackql_query
+
+# resolved provider versions, written alongside the stack manifest
+PROVIDERS_LOCK_FILE = 'stackql_providers.lock'
+
+# records of locked providers verified as installed, keyed by the lock content
+PROVIDER_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.stackql-deploy', 'cache', 'providers')
+
+def get_lock_file_path(stack_dir):
+    return os.path.join(stack_dir, PROVIDERS_LOCK_FILE)
+
+def load_providers_lock(path, logger):
+    """Loads a providers lock file, returns None if it does not exist or can't be read."""
+    try:
+        with open(path, 'r') as f:
+            lock = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"ignoring unreadable providers lock file {path}: {e}")
+        return None
+    if not isinstance(lock, dict) or not isinstance(lock.get('providers'), dict):
+        logger.warning(f"ignoring invalid providers lock file {path}")
+        return None
+    return lock
+
+def save_providers_lock(path, lock, logger):
+    try:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(lock, f, indent=2)
+            f.write('\n')
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"unable to write providers lock file {path}: {e}")
+        return
+    logger.info(f"🔒 provider versions written to {path}")
+
+def version_key(version):
+    """Sort key for provider versions, e.g. v24.09.00251."""
+    return tuple(int(part) for part in re.findall(r'\d+', version))
+
+def resolve_providers(providers, installed_providers):
+    """Returns the installed version used for each manifest provider, the highest unless pinned."""
+    installed_versions = {}
+    for installed in installed_providers:
+        installed_versions.setdefault(installed["name"], []).append(installed["version"])
+
+    resolved = {}
+    for provider in providers:
+        name, _, version = provider.partition("::")
+        versions = installed_versions.get(name)
+        if not versions:
+            continue
+        resolved[name] = version if version in versions else max(versions, key=version_key)
+    return resolved
+
+def get_app_root(stackql):
+    """Returns the stackql application root, providers are installed under `<app_root>/src`."""
+    return os.path.abspath(getattr(stackql, 'app_root', None) or os.path.join(os.getcwd(), '.stackql'))
+
+def get_provider_signatures(locked_providers, app_root):
+    """Returns a stat signature of each locked provider's install directory, or None if one is missing."""
+    signatures = {}
+    for name, version in sorted(locked_providers.items()):
+        try:
+            stat = os.stat(os.path.join(app_root, 'src', name, version))
+        except OSError:
+            return None
+        signatures[name] = [version, stat.st_mtime_ns]
+    return signatures
+
+def get_provider_cache_path(locked_providers, app_root):
+    key = hashlib.sha256(
+        json.dumps({'providers': locked_providers, 'app_root': app_root}, sort_keys=True).encode()
+    ).hexdigest()
+    return os.path.join(PROVIDER_CACHE_DIR, f"{key}.json")
+
+def is_provider_cache_valid(locked_providers, app_root, logger):
+    """Returns True if the locked providers were verified as installed and are unchanged since."""
+    cache_path = get_provider_cache_path(locked_providers, app_root)
+    try:
+        with open(cache_path, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return False
+    signatures = get_provider_signatures(locked_providers, app_root)
+    if signatures is None or cached != signatures:
+        logger.debug("(providers.is_provider_cache_valid) locked providers changed since they were verified")
+        return False
+    return True
+
+def update_provider_cache(locked_providers, app_root, logger):
+    signatures = get_provider_signatures(locked_providers, app_root)
+    if signatures is None:
+        # installed somewhere else, e.g. a custom approot, providers are checked using stackql each run
+        logger.debug(f"(providers.update_provider_cache) locked providers not found under {app_root}")
+        return
+    cache_path = get_provider_cache_path(locked_providers, app_root)
+    try:
+        os.makedirs(PROVIDER_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(signatures, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.debug(f"(providers.update_provider_cache) unable to write {cache_path}: {str(e)}")
+
+def install_providers(providers, stack_dir, stackql, logger, refresh=False, update_lock=False):
+    """Installs the manifest providers, using the versions recorded in the stack's providers lock file.
+
+    Without a lock (or with `refresh`) the manifest providers are resolved using stackql, the resolved
+    versions are recorded in `stackql_providers.lock` only with `update_lock` (a build which isn't a dry
+    run), other runs never create or change the lock.  Later runs pull the locked versions, once these
+    have been verified as installed, runs only stat their install directories rather than querying the
+    registry.  The lock is re-resolved if the manifest providers change.
+    """
+    lock_path = get_lock_file_path(stack_dir)
+    lock = None if refresh else load_providers_lock(lock_path, logger)
+    if lock is not None and lock.get('manifest') != providers:
+        logger.info(f"manifest providers changed since {lock_path} was written, resolving provider versions...")
+        lock = None
+
+    # providers are installed on the server in server mode, these can't be checked locally
+    app_root = None if getattr(stackql, 'server_mode', False) else get_app_root(stackql)
+
+    if lock is not None:
+        locked_providers = lock['providers']
+        if app_root and is_provider_cache_valid(locked_providers, app_root, logger):
+            logger.info(f"providers verified using {lock_path}")
+            return
+        pull_providers([f"{name}::{version}" for name, version in locked_providers.items()], stackql, logger)
+    else:
+        pull_providers(providers, stackql, logger)
+        installed_providers = run_stackql_query("SHOW PROVIDERS", stackql, False, logger)
+        locked_providers = resolve_providers(providers, installed_providers)
+        lock = {'manifest': providers, 'providers': locked_providers}
+        # bundles can be run without the stack directory, the lock is not written
+        if update_lock and os.path.isdir(stack_dir) and lock != load_providers_lock(lock_path, logger):
+            save_providers_lock(lock_path, lock, logger)
+
+    if app_root:
+        update_provider_cache(locked_providers, app_root, logger)
@@ -0,0 +1,78 @@
+# lib/retry.py
+import random
+import time
+
+BACKOFF_STRATEGIES = ('fixed', 'linear', 'exponential')
+
+# anchor options which configure a retry policy in addition to `retries` and `retry_delay`
+POLICY_OPTIONS = ('backoff', 'max_delay', 'jitter', 'max_wait')
+
+class RetryPolicy:
+    """Delay schedule shared by the query, command and polling retry loops.
+
+    `retry_delay` is the initial delay in seconds, grown per attempt according to the `backoff`
+    strategy (fixed, linear or exponential) and capped at `max_delay`.  `jitter` randomizes each
+    delay by up to the given fraction (e.g. 0.2 for +/-20%).  `max_wait` bounds the total time
+    spent retrying, once it is reached the current attempt is the last.
+    """
+
+    def __init__(self, retry_delay=0, backoff='fixed', max_delay=None, jitter=0, max_wait=None):
+        if backoff not in BACKOFF_STRATEGIES:
+            raise ValueError(f"backoff must be one of {', '.join(BACKOFF_STRATEGIES)}, got '{backoff}'")
+        if not 0 <= jitter <= 1:
+            raise ValueError(f"jitter must be between 0 and 1, got {jitter}")
+        if retry_delay < 0 or (max_delay is not None and max_delay < 0) or (max_wait is not None and max_wait < 0):
+            raise ValueError("retry_delay, max_delay and max_wait must not be negative")
+        self.retry_delay = retry_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_wait = max_wait
+
+    @classmethod
+    def from_options(cls, options):
+        return cls(
+            retry_delay=options.get('retry_delay', 0),
+            backoff=options.get('backoff', 'fixed'),
+            max_delay=options.get('max_delay'),
+            jitter=options.get('jitter', 0),
+            max_wait=options.get('max_wait'),
+        )
+
+    def __repr__(self):
+        return (
+            f"RetryPolicy(retry_delay={self.retry_delay}, backoff={self.backoff}, max_delay={self.max_delay}, "
+            f"jitter={self.jitter}, max_wait={self.max_wait})"
+        )
+
+    def expired(self, start_time):
+        """Returns True once the total wait budget is used up."""
+        return self.max_wait is not None and time.time() - start_time >= self.max_wait
+
+    def get_delay(self, attempt, start_time=None):
+        """Returns the delay in seconds to wait after a failed attempt (0 based)."""
+        if self.backoff == 'exponential':
+            delay = self.retry_delay * 2 ** attempt
+        elif self.backoff == 'linear':
+            delay = self.retry_delay * (attempt + 1)
+        else:
+            delay = self.retry_delay
+        if self.max_delay is not None:
+            delay = min(delay, self.max_delay)
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        if self.max_wait is not None and start_time is not None:
+            delay = min(delay, max(0, self.max_wait - (time.time() - start_time)))
+        return round(delay, 2)
+
+def as_retry_policy(delay):
+    """Returns a RetryPolicy for a retry delay given either as a number of seconds or a policy."""
+    if isinstance(delay, RetryPolicy):
+        return delay
+    return RetryPolicy(retry_delay=delay or 0)
+
+def get_retry_delay(options):
+    """Returns the retry delay for query anchor options, as a RetryPolicy if any policy options are set."""
+    if any(option in options for option in POLICY_OPTIONS):
+        return RetryPolicy.from_options(options)
+    return options.get('retry_delay', 0)
@@ -0,0 +1,283 @@
+# lib/scheduler.py
+import fnmatch
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from jinja2 import meta, TemplateSyntaxError
+from .utils import catch_error_and_exit
+from .bootstrap import flush_logs
+from .tracing import in_current_context
+from .templating import get_query_file_path, get_sql_queries, query_file_exists
+
+# custom auth keys which name a context variable rather than holding a value
+AUTH_VAR_KEYS = {"username_var", "password_var", "credentialsenvvar", "keyIDenvvar"}
+
+def get_template_variables(env, source):
+    """Returns the set of undeclared variables referenced by a template string."""
+    try:
+        return meta.find_undeclared_variables(env.parse(source))
+    except TemplateSyntaxError:
+        return set()
+
+def _collect_value_variables(env, value, variables):
+    if isinstance(value, str):
+        variables.update(get_template_variables(env, value))
+    elif isinstance(value, dict):
+        for item in value.values():
+            _collect_value_variables(env, item, variables)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_value_variables(env, item, variables)
+
+def _collect_auth_variables(auth_config, variables):
+    for key, value in auth_config.items():
+        if key in AUTH_VAR_KEYS:
+            variables.add(value)
+        elif isinstance(value, dict):
+            _collect_auth_variables(value, variables)
+
+def get_prop_references(env, resource):
+    """Returns the set of context variables a resource's props are rendered from.
+
+    Props may reference earlier props of the same resource, these are included.
+    """
+    variables = set()
+    for prop in resource.get('props', []):
+        if 'value' in prop:
+            _collect_value_variables(env, prop['value'], variables)
+        if 'values' in prop:
+            variables.add('stack_env')
+        for env_value in prop.get('values', {}).values():
+            if isinstance(env_value, dict):
+                _collect_value_variables(env, env_value.get('value'), variables)
+        variables.update(prop.get('merge', []))
+    return variables
+
+def get_resource_references(env, stack_dir, resource, logger):
+    """Returns the set of context variables a resource reads when it is processed.
+
+    This includes variables referenced by props, the `if` condition, inline `sql` or
+    `run` templates, custom auth variables and every anchor in the resource query file.
+    """
+    variables = get_prop_references(env, resource)
+
+    for key in ('if', 'sql', 'run'):
+        if key in resource:
+            _collect_value_variables(env, resource[key], variables)
+
+    _collect_auth_variables(resource.get('auth', {}), variables)
+
+    resource_type = resource.get('type', 'resource')
+    if resource_type != 'script' and 'sql' not in resource:
+        template_path = get_query_file_path(stack_dir, 'resources', resource)
+        if query_file_exists(template_path):
+            queries, _ = get_sql_queries(template_path, logger)
+            for query in queries.values():
+                variables.update(get_template_variables(env, query))
+
+    # props are resolved within the resource itself
+    variables.difference_update(prop['name'] for prop in resource.get('props', []))
+    logger.debug(f"(scheduler.get_resource_references) [{resource['name']}] references: {sorted(variables)}")
+    return variables
+
+def get_resource_exports(resource):
+    """Returns the set of context variables a resource publishes to the global context."""
+    exported = set()
+    for item in resource.get('exports', []):
+        if isinstance(item, dict):
+            exported.update(item.values())
+        else:
+            exported.add(item)
+    return exported
+
+def get_resource_dependencies(env, stack_dir, resources, logger, references_only=False):
+    """Infers a dependency graph for manifest resources.
+
+    Returns a list where each entry is the set of indexes (into `resources`) that the
+    resource at that position must wait for.  A resource depends on the most recent
+    earlier resource which exports a variable it references, on earlier resources
+    exporting or reading a variable it overwrites, on earlier resources with the same
+    name and on any resources listed in its `depends_on` field.  With `references_only`,
+    only the resources needed to resolve its variables (and `depends_on`) are included.
+    """
+    names = {}
+    producers = {}
+    readers = {}
+    dependencies = []
+
+    for index, resource in enumerate(resources):
+        deps = set()
+
+        for name in resource.get('depends_on', []):
+            if name not in names:
+                catch_error_and_exit(
+                    f"(scheduler.get_resource_dependencies) [{resource['name']}] depends on [{name}], "
+                    f"which is not defined earlier in the manifest.",
+                    logger
+                )
+            deps.update(names[name])
+
+        if not references_only:
+            deps.update(names.get(resource['name'], []))
+
+        references = get_resource_references(env, stack_dir, resource, logger)
+        for var in references:
+            if var in producers:
+                deps.add(producers[var])
+
+        exported = get_resource_exports(resource)
+        if not references_only:
+            for var in exported:
+                if var in producers:
+                    deps.add(producers[var])
+                deps.update(readers.get(var, []))
+
+        for var in references:
+            readers.setdefault(var, []).append(index)
+        for var in exported:
+            producers[var] = index
+            readers[var] = []
+        names.setdefault(resource['name'], []).append(index)
+
+        deps.discard(index)
+        dependencies.append(deps)
+        logger.debug(
+            f"(scheduler.get_resource_dependencies) [{resource['name']}] depends on: "
+            f"{sorted(resources[dep]['name'] for dep in deps)}"
+        )
+
+    return dependencies
+
+def reverse_dependencies(dependencies):
+    """Returns the dependents of each resource, i.e. the graph with every edge reversed."""
+    dependents = [set() for _ in dependencies]
+    for index, deps in enumerate(dependencies):
+        for dep in deps:
+            dependents[dep].add(index)
+    return dependents
+
+def get_closure(indexes, graph):
+    """Returns `indexes` along with every index reachable from them in `graph`."""
+    closure = set()
+    stack = list(indexes)
+    while stack:
+        index = stack.pop()
+        if index not in closure:
+            closure.add(index)
+            stack.extend(graph[index])
+    return closure
+
+def select_resources(resources, dependencies, patterns, logger, include_dependents=False):
+    """Selects resources by name, returns the selected indexes and the indexes of the resources they require.
+
+    `patterns` are shell style globs (e.g. `web_*`) matched against resource names.  Required
+    resources are the upstream closure of the selection in `dependencies`, excluding the selection
+    itself.  With `include_dependents`, resources which depend on a selected resource are selected too.
+    """
+    selected = set()
+    for pattern in patterns:
+        matches = {index for index, resource in enumerate(resources) if fnmatch.fnmatchcase(resource['name'], pattern)}
+        if not matches:
+            catch_error_and_exit(f"(scheduler.select_resources) no resources match [{pattern}]", logger)
+        selected.update(matches)
+    if include_dependents:
+        selected = get_closure(selected, reverse_dependencies(dependencies))
+    required = get_closure(selected, dependencies) - selected
+    return selected, required
+
+class LogCapture(logging.Filter):
+    """Logger filter which holds back records emitted by threads that have started a capture."""
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    def start(self):
+        self._local.records = []
+
+    def stop(self):
+        records = getattr(self._local, 'records', None) or []
+        self._local.records = None
+        return records
+
+    def filter(self, record):
+        records = getattr(self._local, 'records', None)
+        if records is None:
+            return True
+        # arguments are formatted now, as they may change before the record is replayed
+        record.msg = record.getMessage()
+        record.args = None
+        records.append(record)
+        return False
+
+def run_resource_graph(resources, dependencies, process, jobs, logger, order=None, header=None):
+    """Runs `process(resource)` for every resource, honouring `dependencies`, with at most `jobs` workers.
+
+    Log records emitted while a resource is processed are buffered and replayed as one
+    contiguous block per resource, in `order` (defaults to manifest order), so output is
+    identical regardless of completion order.  `header(resource)` is called before a
+    resource's block is replayed.  If any resource fails, no further resources are
+    started, in-flight resources are allowed to finish and the first error is re-raised.
+    Dependencies on resources not in `order` are ignored.
+    """
+    order = list(range(len(resources))) if order is None else list(order)
+    scheduled = set(order)
+    dependencies = [deps & scheduled for deps in dependencies]
+    capture = LogCapture()
+    captured = {}
+
+    def worker(index):
+        capture.start()
+        try:
+            return process(resources[index])
+        finally:
+            captured[index] = capture.stop()
+
+    def flush(index):
+        if header:
+            header(resources[index])
+        for record in captured.pop(index):
+            logger.handle(record)
+
+    pending = set(order)
+    completed = set()
+    running = {}
+    failure = None
+    next_flush = 0
+
+    logger.addFilter(capture)
+    try:
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='stackql-deploy') as executor:
+            while pending or running:
+                if failure is None:
+                    for index in [i for i in order if i in pending and dependencies[i] <= completed]:
+                        pending.discard(index)
+                        running[executor.submit(in_current_context(worker), index)] = index
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    index = running.pop(future)
+                    if future.exception() is not None:
+                        if failure is None:
+                            failure = future.exception()
+                    else:
+                        completed.add(index)
+
+                while next_flush < len(order) and order[next_flush] in completed:
+                    flush(order[next_flush])
+                    next_flush += 1
+    finally:
+        logger.removeFilter(capture)
+        for index in order:
+            if index in captured:
+                flush(index)
+        # written before an error is reported
+        flush_logs()
+
+    if failure is not None:
+        raise failure
+    if pending:
+        unresolved = sorted(resources[index]['name'] for index in pending)
+        catch_error_and_exit(f"(scheduler.run_resource_graph) unresolvable dependencies for: {unresolved}", logger)
@@ -0,0 +1,146 @@
+# lib/server.py
+import atexit
+import queue
+import threading
+from .utils import error_detected, normalize_value
+
+def parse_server_address(server):
+    """Parses a `host:port` server address, returns a (host, port) tuple."""
+    host, sep, port = server.rpartition(':')
+    if not sep or not host or not port.isdigit():
+        raise ValueError(f"server address must be in the format 'host:port', got '{server}'")
+    return host, int(port)
+
+def import_psycopg():
+    """Imports psycopg, which is only required to use a stackql server, returns (psycopg, dict_row)."""
+    try:
+        import psycopg
+        from psycopg.rows import dict_row
+    except ImportError:
+        raise ImportError(
+            "psycopg is required to use a stackql server but is not installed, "
+            "install it using `pip install psycopg[binary]`"
+        )
+    return psycopg, dict_row
+
+def normalize_row(row):
+    """Normalizes the values of a result row returned over the postgres wire protocol."""
+    return {key: normalize_value(value) for key, value in row.items()}
+
+class StackQLServerPool:
+    """Executes stackql queries against a running `stackql srv` instance over a bounded pool of
+    persistent postgres wire protocol connections.
+
+    Implements the subset of the `pystackql.StackQL` interface used by stackql-deploy
+    (`execute`, `executeStmt` and `properties`), so it can be used in place of an exec mode instance.
+    """
+
+    def __init__(self, server, logger, pool_size=4):
+        self.psycopg, self.dict_row = import_psycopg()
+        self.server_address, self.server_port = parse_server_address(server)
+        self.pool_size = pool_size
+        self.logger = logger
+        self.server_mode = True
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._connections = []
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+        # connect eagerly so an unreachable server is reported before any work is started
+        self._idle.put(self._connect())
+
+    def _connect(self):
+        self.logger.debug(
+            f"(server.StackQLServerPool) opening connection to {self.server_address}:{self.server_port}"
+        )
+        conn = self.psycopg.connect(
+            dbname='stackql',
+            user='stackql',
+            host=self.server_address,
+            port=self.server_port,
+            autocommit=True,
+            row_factory=self.dict_row
+        )
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _run(self, query, is_statement):
+        """Runs a query on a pooled connection, reconnecting once if the connection was lost."""
+        self._slots.acquire()
+        try:
+            for attempt in range(2):
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._connect()
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute(query)
+                        if is_statement:
+                            result = cur.statusmessage
+                        else:
+                            result = cur.fetchall() if cur.description else []
+                    self._idle.put(conn)
+                    return result
+                except self.psycopg.OperationalError:
+                    self._discard(conn)
+                    if attempt == 1:
+                        raise
+                    self.logger.debug("(server.StackQLServerPool) connection lost, reconnecting...")
+                except Exception:
+                    self._idle.put(conn)
+                    raise
+        finally:
+            self._slots.release()
+
+    def _check_custom_auth(self, custom_auth, env_vars):
+        # queries would run using the server's credentials, possibly against another account
+        if custom_auth or env_vars:
+            raise ValueError(
+                "custom auth and command specific environment variables are not supported using a stackql server"
+            )
+
+    def execute(self, query, suppress_errors=True, custom_auth=None, env_vars=None, **kwargs):
+        self._check_custom_auth(custom_auth, env_vars)
+        try:
+            return [normalize_row(row) for row in self._run(query, False)]
+        except Exception as e:
+            return [{'error': str(e).strip()}]
+
+    def executeStmt(self, query, custom_auth=None, env_vars=None, **kwargs):
+        self._check_custom_auth(custom_auth, env_vars)
+        try:
+            return {'message': self._run(query, True) or ''}
+        except Exception as e:
+            message = str(e).strip()
+            # provider errors which are retried in exec mode are surfaced as messages
+            if error_detected({'message': message}):
+                return {'message': message}
+            return {'error': message}
+
+    def properties(self):
+        return {
+            'server_mode': True,
+            'server_address': self.server_address,
+            'server_port': self.server_port,
+            'pool_size': self.pool_size,
+        }
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
@@ -0,0 +1,179 @@
+# lib/snapshot.py
+import json
+import re
+import sqlite3
+import threading
+import time
+from .cache import get_write_targets
+from .utils import normalize_value
+
+# provider tables read by a query
+TABLE_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_]\w*\.\w+\.\w+)\b', re.IGNORECASE)
+
+# provider parameters which scope a table to a slice, e.g. a region or project
+SLICE_COLUMNS = (
+    'region', 'project', 'zone', 'subscriptionId', 'resourceGroupName', 'account_id', 'deployment_name', 'endpoint'
+)
+SLICE_PATTERN = re.compile(r'\b(' + '|'.join(SLICE_COLUMNS) + r")\s*=\s*'([^']*)'")
+
+# queries using these parameters fetch a single resource, they are not served from a snapshot
+GET_PATTERN = re.compile(r'\bdata__Identifier\b', re.IGNORECASE)
+
+# comparisons with numeric or boolean literals depend on the provider's column types, snapshots are
+# loaded from the string values stackql returns, so these queries are not served from a snapshot
+TYPED_COMPARISON_PATTERN = re.compile(
+    r'(?:=|<>|!=|<|>|\bIS(?:\s+NOT)?|\bIN\s*\(|\bBETWEEN|\bAND)\s*(?:[-+]?\.?\d|TRUE\b|FALSE\b)'
+    r'|(?:\b\d+(?:\.\d+)?|\bTRUE|\bFALSE)\s*(?:=|<>|!=|<|>)',
+    re.IGNORECASE
+)
+
+def get_query_slice(query):
+    """Returns the (table, params) slice a query reads from, or None if it can't be served from a snapshot.
+
+    Queries must read from a single provider table and include at least one slice parameter, each
+    with a single value, and must only compare values with string literals.
+    """
+    tables = {table.lower() for table in TABLE_PATTERN.findall(query)}
+    if len(tables) != 1 or GET_PATTERN.search(query) or TYPED_COMPARISON_PATTERN.search(query):
+        return None
+    params = {}
+    for column, value in SLICE_PATTERN.findall(query):
+        if params.get(column, value) != value:
+            return None
+        params[column] = value
+    if not params:
+        return None
+    return tables.pop(), tuple(sorted(params.items()))
+
+def to_sqlite_value(value):
+    value = normalize_value(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, bool):
+        return str(value).lower()
+    return value
+
+class _Slice:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.fetched_at = None
+        self.generation = 0
+        self.empty = False
+        self.unsupported = False
+
+class SnapshotCache:
+    """Wraps a StackQL instance, serving queries over a provider table slice from a local snapshot.
+
+    The first query over a slice (e.g. `aws.ec2.vpc_tags` in a region) lists the slice once and
+    stores it in an in-memory SQLite database, matching queries are then evaluated locally.
+    Snapshots expire after `ttl` seconds and are dropped when a statement writes to the same
+    provider.  A query seen again for the same snapshot is a retry or poll, so the slice is
+    re-fetched first.  Queries which can't be evaluated locally are passed through.
+    """
+
+    def __init__(self, stackql, logger, ttl=60):
+        self.stackql = stackql
+        self.logger = logger
+        self.ttl = ttl
+        self._db = sqlite3.connect(':memory:', check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._slices = {}
+        self._served = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.stackql, name)
+
+    def execute(self, query, suppress_errors=True, custom_auth=None, env_vars=None, **kwargs):
+        slice_key = None if custom_auth or env_vars else get_query_slice(query)
+        if slice_key is not None:
+            result = self._execute_local(query, slice_key)
+            if result is not None:
+                return result
+        return self.stackql.execute(
+            query, suppress_errors=suppress_errors, custom_auth=custom_auth, env_vars=env_vars, **kwargs
+        )
+
+    def executeStmt(self, query, custom_auth=None, env_vars=None, **kwargs):
+        try:
+            return self.stackql.executeStmt(query, custom_auth, env_vars, **kwargs)
+        finally:
+            self.invalidate(query)
+
+    def invalidate(self, command):
+        providers = get_write_targets(command)
+        with self._lock:
+            for (table, _), snapshot in self._slices.items():
+                if not providers or table.split('.')[0] in providers:
+                    snapshot.fetched_at = None
+
+    def _get_slice(self, slice_key):
+        with self._lock:
+            snapshot = self._slices.get(slice_key)
+            if snapshot is None:
+                snapshot = self._slices[slice_key] = _Slice(f"snapshot_{len(self._slices)}")
+            return snapshot
+
+    def _execute_local(self, query, slice_key):
+        snapshot = self._get_slice(slice_key)
+        if snapshot.unsupported:
+            return None
+        with snapshot.lock:
+            served = self._served.get(query)
+            expired = snapshot.fetched_at is None or time.time() - snapshot.fetched_at > self.ttl
+            if expired or (served == snapshot.generation and not snapshot.empty):
+                self._fetch(snapshot, slice_key)
+            if snapshot.unsupported or snapshot.empty:
+                return None
+            generation = snapshot.generation
+
+        table, _ = slice_key
+        local_query = re.sub(r'\b' + re.escape(table) + r'\b', snapshot.name, query, flags=re.IGNORECASE)
+        try:
+            with self._db_lock:
+                cursor = self._db.execute(local_query.strip().rstrip(';'))
+                columns = [column[0] for column in cursor.description or []]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            self.logger.debug(f"(snapshot.SnapshotCache) unable to evaluate query locally, passing through: {str(e)}")
+            return None
+        self._served[query] = generation
+        self.logger.debug(f"(snapshot.SnapshotCache) query evaluated against snapshot of {table}")
+        return rows
+
+    def _fetch(self, snapshot, slice_key):
+        """Lists a table slice into the local database."""
+        table, params = slice_key
+        predicates = ' AND '.join(f"{column} = '{value}'" for column, value in params)
+        self.logger.debug(f"(snapshot.SnapshotCache) fetching snapshot of {table} where {predicates}")
+        rows = self.stackql.execute(f"SELECT * FROM {table} WHERE {predicates}", suppress_errors=True)
+        if not isinstance(rows, list) or any(not isinstance(row, dict) or 'error' in row for row in rows):
+            # e.g. a required parameter is not a slice parameter
+            self.logger.debug(f"(snapshot.SnapshotCache) unable to snapshot {table}, passing through: {rows}")
+            snapshot.unsupported = True
+            return
+        snapshot.fetched_at = time.time()
+        # an empty slice has no columns to evaluate queries against, queries are passed through
+        # until the snapshot expires or is invalidated
+        snapshot.empty = not rows
+        if snapshot.empty:
+            return
+
+        columns = list(dict.fromkeys(column for row in rows for column in row))
+        # slice parameters are not always returned as columns
+        constants = {column: value for column, value in params if column not in columns}
+        columns += list(constants)
+        column_list = ', '.join(f'"{column}"' for column in columns)
+        with self._db_lock:
+            self._db.execute(f'DROP TABLE IF EXISTS "{snapshot.name}"')
+            self._db.execute(f'CREATE TABLE "{snapshot.name}" ({column_list})')
+            self._db.executemany(
+                f'INSERT INTO "{snapshot.name}" VALUES ({", ".join("?" for _ in columns)})',
+                [
+                    [to_sqlite_value(row.get(column, constants.get(column))) for column in columns]
+                    for row in rows
+                ]
+            )
+            self._db.commit()
+        snapshot.generation += 1
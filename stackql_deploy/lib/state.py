@@ -0,0 +1,99 @@
+# lib/state.py
+import datetime
+import hashlib
+import json
+import os
+from .utils import catch_error_and_exit
+from .templating import get_query_file_path, get_sql_queries, query_file_exists
+from .scheduler import get_resource_exports, get_resource_references
+
+# default location of state files, relative to the stack directory
+STATE_DIR = '.stackql-deploy'
+
+def get_state_file_path(stack_dir, stack_env, state_file=None):
+    """Returns the path of the state file for a stack environment."""
+    if state_file:
+        return state_file
+    return os.path.join(stack_dir, STATE_DIR, f"{stack_env}.state.json")
+
+def new_state(stack_name, stack_env):
+    return {'stack_name': stack_name, 'stack_env': stack_env, 'resources': {}}
+
+def load_state(path, logger):
+    """Loads a state file, returns None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        catch_error_and_exit(f"(state.load_state) failed to read state file {path}: {e}", logger)
+    if not isinstance(state, dict) or not isinstance(state.get('resources'), dict):
+        catch_error_and_exit(f"(state.load_state) invalid state file {path}", logger)
+    return state
+
+def save_state(path, state, logger):
+    """Writes a state file, replacing any existing file atomically."""
+    state['updated'] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    try:
+        dest_dir = os.path.dirname(path)
+        if dest_dir:
+            os.makedirs(dest_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=2, default=str)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        catch_error_and_exit(f"(state.save_state) failed to write state file {path}: {e}", logger)
+    logger.debug(f"(state.save_state) state written to {path}")
+
+def remove_state(path, logger):
+    if os.path.exists(path):
+        os.remove(path)
+        logger.info(f"🗑️ removed state file {path}")
+
+def get_missing_exports(state, resource):
+    """Returns the exports declared by a resource which are not recorded for it in a state file."""
+    recorded = state['resources'].get(resource['name'], {}).get('exports', {})
+    return get_resource_exports(resource) - recorded.keys()
+
+def remove_resource_state(path, names, logger):
+    """Removes the entries for torn down resources from a state file."""
+    state = load_state(path, logger)
+    if state is None:
+        return
+    for name in names:
+        state['resources'].pop(name, None)
+    save_state(path, state, logger)
+    logger.debug(f"(state.remove_resource_state) removed {names} from {path}")
+
+def get_resource_fingerprint(env, stack_dir, resource, full_context, logger):
+    """Returns a hash of everything a resource's queries are rendered from.
+
+    This covers the resource definition, its queries and the context values it references
+    (including its rendered props), so any change to the manifest, template, globals or upstream
+    exports produces a new fingerprint.
+    """
+    variables = get_resource_references(env, stack_dir, resource, logger)
+    variables.update(prop['name'] for prop in resource.get('props', []))
+    queries = None
+    template_path = get_query_file_path(stack_dir, 'resources', resource)
+    if query_file_exists(template_path):
+        queries = get_sql_queries(template_path, logger)
+    fingerprint_data = {
+        'resource': resource,
+        'queries': queries,
+        'context': {var: full_context.get(var) for var in sorted(variables)},
+    }
+    return hashlib.sha256(json.dumps(fingerprint_data, sort_keys=True, default=str).encode()).hexdigest()
+
+def is_resource_unchanged(resource_state, fingerprint, ttl):
+    """Returns True if a resource was deployed with the same fingerprint within `ttl` seconds."""
+    if not resource_state or resource_state.get('fingerprint') != fingerprint:
+        return False
+    try:
+        deployed_at = datetime.datetime.fromisoformat(resource_state['deployed_at'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    age = datetime.datetime.now(datetime.timezone.utc) - deployed_at
+    return age.total_seconds() <= ttl
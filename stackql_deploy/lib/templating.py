@@ -1,10 +1,28 @@
 # lib/templating.py
-import json
 import os
+import threading
 from .utils import catch_error_and_exit
+from .bootstrap import lazy_format
+from .tracing import span
+from .retry import get_retry_delay
+from .context import QueryScope, render_template
 from jinja2 import TemplateError
 from pprint import pformat
 
+# parsed query files by path, along with the modification time and size they were parsed at (None for
+# query files loaded from a bundle)
+_query_files = {}
+_query_files_lock = threading.Lock()
+
+def parse_anchor_option_value(value):
+    """Parse an anchor option value as an int, a float or a string."""
+    for option_type in (int, float):
+        try:
+            return option_type(value)
+        except ValueError:
+            pass
+    return value
+
 def parse_anchor(anchor, logger):
     """Parse anchor to extract key and options."""
     parts = anchor.split(',')
@@ -13,46 +31,47 @@ def parse_anchor(anchor, logger):
     for part in parts[1:]:
         if '=' in part:
             option_key, option_value = part.split('=')
-            options[option_key.strip()] = int(option_value.strip())
+            options[option_key.strip()] = parse_anchor_option_value(option_value.strip())
     return key, options
 
-def is_json(myjson, logger):
+def render_query(res_name, env, key, query, render_context, logger):
     try:
-        obj = json.loads(myjson)
-        return isinstance(obj, (dict, list))  # Only return True for JSON objects or arrays
-    except ValueError:
-        return False
-
-def render_queries(res_name, env, queries, context, logger):
-    rendered_queries = {}
-    for key, query in queries.items():
-        logger.debug(f"(templating.render_queries) [{res_name}] [{key}] query template:\n\n{query}\n")
-        try:
-            temp_context = context.copy()
-
-            for ctx_key, ctx_value in temp_context.items():
-                if isinstance(ctx_value, str) and is_json(ctx_value, logger):
-                    properties = json.loads(ctx_value)
-                    # Serialize JSON ensuring booleans are lower case and using correct JSON syntax
-                    json_str = json.dumps(
-                        properties, ensure_ascii=False, separators=(',', ':')
-                    ).replace('True', 'true').replace('False', 'false')
-                    # Correctly format JSON to use double quotes and pass directly since template handles quoting
-                    # json_str = json_str.replace("'", "\\'")  # escape single quotes if any within strings
-                    temp_context[ctx_key] = json_str
-                # No need to alter non-JSON strings, assume the template handles them correctly
-
-            template = env.from_string(query)
-            rendered_query = template.render(temp_context)
-            logger.debug(f"(templating.render_queries) [{res_name}] [{key}] rendered query:\n\n{rendered_query}\n")
-            rendered_queries[key] = rendered_query
-
-        except TemplateError as e:
-            raise RuntimeError(f"(templating.render_queries) error rendering query for [{res_name}] [{key}]: {e}")
-        except json.JSONDecodeError:
-            continue  # Skip non-JSON content
-
-    return rendered_queries
+        template = env.from_string(query)
+        rendered_query = render_template(template, render_context)
+        logger.debug(
+            "(templating.render_query) [%s] [%s] query template:\n\n%s\n\nrendered query:\n\n%s\n",
+            res_name,
+            key,
+            query,
+            rendered_query
+        )
+        return rendered_query
+    except TemplateError as e:
+        raise RuntimeError(f"(templating.render_query) error rendering query for [{res_name}] [{key}]: {e}")
+
+class QueryAnchor(dict):
+    """A query anchor with its `template` and `options`, the `rendered` query is produced on first access.
+
+    Commands only render the anchors they run, e.g. teardown never renders `create`.
+    """
+
+    def __init__(self, template, options, render):
+        super().__init__(template=template, options=options)
+        self._render = render
+
+    def _ensure_rendered(self):
+        if not dict.__contains__(self, 'rendered'):
+            self['rendered'] = self._render()
+
+    def __getitem__(self, key):
+        if key == 'rendered':
+            self._ensure_rendered()
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        if key == 'rendered':
+            self._ensure_rendered()
+        return super().get(key, default)
 
 def load_sql_queries(file_path, logger):
     """Loads SQL queries from a file, splits them by anchors, and extracts options."""
@@ -83,44 +102,113 @@ def load_sql_queries(file_path, logger):
 
     return queries, options
 
+def get_sql_queries(file_path, logger):
+    """Returns the queries and options in a query file, the file is only parsed again if it has changed.
+
+    The returned dicts are shared and must not be modified.
+    """
+    key = os.path.abspath(file_path)
+    with _query_files_lock:
+        entry = _query_files.get(key)
+    if entry is not None and entry[0] is None:
+        return entry[1], entry[2]
+    stat = os.stat(file_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if entry is not None and entry[0] == signature:
+        return entry[1], entry[2]
+
+    queries, options = load_sql_queries(file_path, logger)
+    with _query_files_lock:
+        _query_files[key] = (signature, queries, options)
+    logger.debug(f"(templating.get_sql_queries) parsed query file {file_path}")
+    return queries, options
+
 #
 # exported fuctions
 #
 
+def add_bundled_query_files(stack_dir, query_files):
+    """Adds the parsed query files from a bundle, keyed by their path relative to the resources directory."""
+    with _query_files_lock:
+        for relative_path, (queries, options) in query_files.items():
+            path = os.path.join(stack_dir, 'resources', *relative_path.split('/'))
+            _query_files[os.path.abspath(path)] = (None, queries, options)
+
+def query_file_exists(file_path):
+    with _query_files_lock:
+        entry = _query_files.get(os.path.abspath(file_path))
+    return (entry is not None and entry[0] is None) or os.path.exists(file_path)
+
+def warm_query_cache(stack_dir, logger):
+    """Parses every query file in the stack's resources directory in a single pass."""
+    parsed = 0
+    for root, _, files in os.walk(os.path.join(stack_dir, 'resources')):
+        for name in files:
+            if not name.endswith('.iql'):
+                continue
+            try:
+                get_sql_queries(os.path.join(root, name), logger)
+                parsed += 1
+            except (OSError, UnicodeDecodeError) as e:
+                # reported when the file is used
+                logger.debug(f"(templating.warm_query_cache) unable to parse {name}: {str(e)}")
+    logger.debug(f"(templating.warm_query_cache) parsed {parsed} query files")
+
+def get_query_file_path(stack_dir, doc_key, resource):
+    """Returns the path of the query file for a resource."""
+    if resource.get('file'):
+        return os.path.join(stack_dir, doc_key, resource['file'])
+    return os.path.join(stack_dir, doc_key, f"{resource['name']}.iql")
+
 def get_queries(env, stack_dir, doc_key, resource, full_context, logger):
     """Returns an object with query templates, rendered queries, and options for a resource."""
     result = {}
 
-    if resource.get('file'):
-        template_path = os.path.join(stack_dir, doc_key, resource['file'])
-    else:
-        template_path = os.path.join(stack_dir, doc_key, f"{resource['name']}.iql")
+    template_path = get_query_file_path(stack_dir, doc_key, resource)
 
-    if not os.path.exists(template_path):
+    if not query_file_exists(template_path):
         catch_error_and_exit(f"(templating.get_queries) query file not found: {template_path}", logger)
 
+    # anchors are rendered from the resource context rather than a copy of it, the globals the
+    # resource references are copied into it when it is created (see get_full_context)
+    render_context = QueryScope(full_context)
+
+    def render(key, template):
+        try:
+            with span('render query', {'stackql_deploy.anchor': key}):
+                return render_query(resource['name'], env, key, template, render_context, logger)
+        except Exception as e:
+            catch_error_and_exit(
+                f"(templating.get_queries) failed to render [{key}] query for [{resource['name']}]: {str(e)}",
+                logger
+            )
+
     try:
-        query_templates, query_options = load_sql_queries(template_path, logger)
-        rendered_queries = render_queries(resource['name'], env, query_templates, full_context, logger)
+        query_templates, query_options = get_sql_queries(template_path, logger)
 
-        for anchor, template in query_templates.items():
+        for key, template in query_templates.items():
             # fix backward compatibility for preflight and postdeploy queries
+            anchor = key
             if anchor == 'preflight':
                 anchor = 'exists'
             elif anchor == 'postdeploy':
                 anchor = 'statecheck'
             # end backward compatibility fix
-            result[anchor] = {
-                "template": template,
-                "rendered": rendered_queries.get(anchor, ""),
-                "options": {
-                    "retries": query_options.get(anchor, {}).get('retries', 1),
-                    "retry_delay": query_options.get(anchor, {}).get('retry_delay', 0)
-                }
-            }
-
-        formatted_result = pformat(result, width=120, indent=2)
-        logger.debug(f"(templating.get_queries) queries for [{resource['name']}]:\n{formatted_result}")
+            result[anchor] = QueryAnchor(
+                template,
+                {
+                    **query_options.get(key, {}),
+                    "retries": query_options.get(key, {}).get('retries', 1),
+                    "retry_delay": get_retry_delay(query_options.get(key, {}))
+                },
+                lambda key=key, template=template: render(key, template)
+            )
+
+        logger.debug(
+            "(templating.get_queries) queries for [%s]:\n%s",
+            resource['name'],
+            lazy_format(pformat, result, width=120, indent=2)
+        )
         return result
     except Exception as e:
         catch_error_and_exit(
@@ -133,39 +221,21 @@ def render_inline_template(env, resource_name, template_string, full_context, lo
     Renders a single template string using the provided context.
     Similar to get_queries but for inline templates rather than files.
     """
-    logger.debug(f"(templating.render_inline_template) [{resource_name}] template:\n\n{template_string}\n")
-
     try:
-        # Process the context the same way as in render_queries
-        temp_context = full_context.copy()
-
-        for ctx_key, ctx_value in temp_context.items():
-            if isinstance(ctx_value, str) and is_json(ctx_value, logger):
-                properties = json.loads(ctx_value)
-                # Serialize JSON ensuring booleans are lower case and using correct JSON syntax
-                json_str = json.dumps(
-                    properties, ensure_ascii=False, separators=(',', ':')
-                ).replace('True', 'true').replace('False', 'false')
-                # Correctly format JSON to use double quotes and pass directly since template handles quoting
-                # json_str = json_str.replace("'", "\\'")  # escape single quotes if any within strings
-                temp_context[ctx_key] = json_str
+        # Process the context the same way as in get_queries
+        render_context = QueryScope(full_context)
 
         # Render the template
         template = env.from_string(template_string)
-        rendered_template = template.render(temp_context)
+        rendered_template = render_template(template, render_context)
 
         logger.debug(
-            f"(templating.render_inline_template) [{resource_name}] rendered template:"
-            f"\n\n{rendered_template}\n"
+            "(templating.render_inline_template) [%s] template:\n\n%s\n\nrendered template:\n\n%s\n",
+            resource_name,
+            template_string,
+            rendered_template
         )
         return rendered_template
 
     except TemplateError as e:
         raise RuntimeError(f"(templating.render_inline_template) error rendering template for [{resource_name}]: {e}")
-    except json.JSONDecodeError as e:
-        # Handle JSON errors more gracefully
-        logger.warning(f"(templating.render_inline_template) JSON decode error in context for [{resource_name}]: {e}")
-        # Try rendering anyway, might work with non-JSON parts of the context
-        template = env.from_string(template_string)
-        rendered_template = template.render(temp_context)
-        return rendered_template
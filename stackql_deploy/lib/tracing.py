@@ -0,0 +1,199 @@
+# lib/tracing.py
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+
+#
+# run, resource, phase and stackql call spans, written to a file in the OTLP/JSON format
+# (the body of an OTLP/HTTP export request) which trace viewers and collectors can load
+#
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+# the span new spans are children of, copied into worker threads with the context
+_current_span = contextvars.ContextVar('stackql_deploy_span', default=None)
+
+_tracer = None
+
+class Span:
+    __slots__ = ('name', 'kind', 'span_id', 'parent_span_id', 'attributes', 'start_time', 'end_time', 'status')
+
+    def __init__(self, name, kind, parent_span_id, attributes):
+        self.name = name
+        self.kind = kind
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.status = None
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def to_otlp(self, trace_id):
+        span = {
+            'traceId': trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_time),
+            'endTimeUnixNano': str(self.end_time),
+            'attributes': to_otlp_attributes(self.attributes),
+        }
+        if self.parent_span_id:
+            span['parentSpanId'] = self.parent_span_id
+        if self.status:
+            span['status'] = self.status
+        return span
+
+class _NoopSpan:
+    """Returned by `span` when tracing is not enabled."""
+
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Tracer:
+    def __init__(self, path, resource_attributes):
+        self.path = path
+        self.trace_id = secrets.token_hex(16)
+        self.resource_attributes = resource_attributes
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def to_otlp(self):
+        from .. import __version__
+        with self.lock:
+            spans = [span.to_otlp(self.trace_id) for span in self.spans]
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': to_otlp_attributes(self.resource_attributes)},
+                'scopeSpans': [{
+                    'scope': {'name': 'stackql-deploy', 'version': __version__},
+                    'spans': spans
+                }]
+            }]
+        }
+
+def to_otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # 64 bit integers are strings in OTLP/JSON
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+def to_otlp_attributes(attributes):
+    return [{'key': key, 'value': to_otlp_value(value)} for key, value in attributes.items()]
+
+@contextlib.contextmanager
+def span(name, attributes=None, kind=SPAN_KIND_INTERNAL):
+    """Records the enclosed block as a span, a child of the current span.
+
+    More attributes can be set on the yielded span, e.g. once a result is known.  Errors, including
+    exits through `catch_error_and_exit`, set the span's status to error.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield _NOOP_SPAN
+        return
+
+    parent = _current_span.get()
+    current = Span(
+        name,
+        kind,
+        parent.span_id if parent else None,
+        {key: value for key, value in (attributes or {}).items() if value is not None}
+    )
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        if current.status is None and not (isinstance(e, SystemExit) and not e.code):
+            current.status = {'code': STATUS_CODE_ERROR, 'message': str(e) or type(e).__name__}
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_time = time.time_ns()
+        tracer.add(current)
+
+def resource_span_attributes(resource, anchor=None):
+    return {'stackql_deploy.resource': resource.get('name'), 'stackql_deploy.anchor': anchor}
+
+def traced_resource(name):
+    """Records each call of a method processing a resource, `method(self, resource, ...)`, as a span."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, resource, *args, **kwargs):
+            attributes = {
+                'stackql_deploy.resource': resource.get('name'),
+                'stackql_deploy.resource_type': resource.get('type', 'resource'),
+            }
+            with span(name, attributes):
+                return method(self, resource, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_error(message):
+    """Sets the status of the current span to error with `message`, e.g. before exiting."""
+    current = _current_span.get()
+    if _tracer is not None and current is not None:
+        current.status = {'code': STATUS_CODE_ERROR, 'message': str(message)}
+
+def in_current_context(func):
+    """Binds a callable to a copy of the current context, so spans opened by it on a worker thread are
+    children of the current span.  Wrap each call separately, a context can't be entered by two threads."""
+    if _tracer is None:
+        return func
+    return functools.partial(contextvars.copy_context().run, func)
+
+def write_trace(tracer, logger):
+    try:
+        directory = os.path.dirname(os.path.abspath(tracer.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(tracer.path, 'w') as f:
+            json.dump(tracer.to_otlp(), f)
+    except OSError as e:
+        logger.warning(f"unable to write trace file {tracer.path}: {e}")
+        return
+    logger.info(f"🔭 trace with {len(tracer.spans)} spans written to {tracer.path}")
+
+@contextlib.contextmanager
+def trace_run(path, command, stack_dir, stack_env, logger):
+    """Traces a command run, writing its spans to `path` on exit, a no-op if `path` is not set."""
+    global _tracer
+    if not path:
+        yield _NOOP_SPAN
+        return
+
+    _tracer = Tracer(path, {
+        'service.name': 'stackql-deploy',
+        'stackql_deploy.stack_dir': stack_dir,
+        'stackql_deploy.stack_env': stack_env,
+    })
+    try:
+        with span(command, {'stackql_deploy.command': command}) as run_span:
+            yield run_span
+    finally:
+        tracer, _tracer = _tracer, None
+        write_trace(tracer, logger)
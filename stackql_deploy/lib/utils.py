@@ -6,6 +6,11 @@ import json
 import sys
 import subprocess
 import re
+from concurrent.futures import ThreadPoolExecutor
+from .retry import as_retry_policy
+from .context import as_context_value
+from .bootstrap import flush_logs, lazy_format
+from .tracing import span, record_error, in_current_context, SPAN_KIND_CLIENT
 
 class BorderColor(Enum):
     YELLOW = '\033[93m'  # Bright yellow
@@ -13,6 +18,8 @@ class BorderColor(Enum):
     RED = '\033[91m'     # Bright red
 
 def print_unicode_box(message: str, color: BorderColor = BorderColor.YELLOW):
+    # queued log records are written first, so the box appears after them
+    flush_logs()
     border_color = color.value
     reset_color = '\033[0m'
 
@@ -28,6 +35,8 @@ def print_unicode_box(message: str, color: BorderColor = BorderColor.YELLOW):
 
 def catch_error_and_exit(errmsg, logger):
     logger.error(errmsg)
+    record_error(errmsg)
+    flush_logs()
     sys.exit("stackql-deploy operation failed 🚫")
 
 def get_type(resource, logger):
@@ -37,80 +46,77 @@ def get_type(resource, logger):
     else:
         return type
 
-def run_stackql_query(query, stackql, suppress_errors, logger, custom_auth=None, env_vars=None, retries=0, delay=5):
-    attempt = 0
-    last_error = None
-    while attempt <= retries:
-        try:
-            logger.debug(f"(utils.run_stackql_query) executing stackql query on attempt {attempt + 1}:\n\n{query}\n")
-            result = stackql.execute(query, suppress_errors=suppress_errors, custom_auth=custom_auth, env_vars=env_vars)
-            logger.debug(f"(utils.run_stackql_query) stackql query result (type:{type(result)}): {result}")
-
-            # Check if result is a list (expected outcome)
-            if isinstance(result, list):
-                if len(result) == 0:
-                    logger.debug("(utils.run_stackql_query) stackql query executed successfully, retrieved 0 items.")
-                    pass
-                elif result and 'error' in result[0]:
-                    error_message = result[0]['error']
-                    last_error = error_message  # Store the error for potential return
-                    if not suppress_errors:
-                        if attempt == retries:
-                            # If retries are exhausted, log the error and exit
-                            catch_error_and_exit(
-                                (
-                                    f"(utils.run_stackql_query) error occurred during stackql query execution:\n\n"
-                                    f"{error_message}\n"
-                                ),
-                                logger
-                            )
-                        else:
-                            # Log the error and prepare for another attempt
-                            logger.error(f"attempt {attempt + 1} failed:\n\n{error_message}\n")
-                elif 'count' in result[0]:
-                    # If the result is a count query, return the count
-                    logger.debug(
-                        f"(utils.run_stackql_query) stackql query executed successfully, "
-                        f"retrieved count: {result[0]['count']}."
-                    )
-                    if int(result[0]['count']) > 1:
-                        catch_error_and_exit(
-                            f"(utils.run_stackql_query) detected more than one resource matching the query criteria, "
-                            f"expected 0 or 1, got {result[0]['count']}\n",
-                            logger
-                        )
-                    return result
-                else:
-                    # If no errors or errors are suppressed, return the result
-                    logger.debug(
-                        f"(utils.run_stackql_query) stackql query executed successfully, retrieved {len(result)} items."
-                    )
-                    return result
-            else:
-                # Handle unexpected result format
+def evaluate_query_result(result, attempt, retries, suppress_errors, logger):
+    """Evaluates the result of a single stackql query attempt.
+
+    Returns a tuple of (done, error): done is True when the result should be returned to the caller,
+    error is the error message of a failed attempt (if any).  Exits if retries are exhausted.
+    """
+    # Check if result is a list (expected outcome)
+    if isinstance(result, list):
+        if len(result) == 0:
+            logger.debug("(utils.run_stackql_query) stackql query executed successfully, retrieved 0 items.")
+            return False, None
+        elif result and 'error' in result[0]:
+            error_message = result[0]['error']
+            if not suppress_errors:
                 if attempt == retries:
+                    # If retries are exhausted, log the error and exit
                     catch_error_and_exit(
-                        "(utils.run_stackql_query) unexpected result format received from stackql query execution.",
+                        (
+                            f"(utils.run_stackql_query) error occurred during stackql query execution:\n\n"
+                            f"{error_message}\n"
+                        ),
                         logger
                     )
                 else:
-                    logger.error("(utils.run_stackql_query) unexpected result format, retrying...")
-
-        except Exception as e:
-            # Log the exception and check if retry attempts are exhausted
-            last_error = str(e)  # Store the exception for potential return
-            if attempt == retries:
+                    # Log the error and prepare for another attempt
+                    logger.error(f"attempt {attempt + 1} failed:\n\n{error_message}\n")
+            return False, error_message
+        elif 'count' in result[0]:
+            # If the result is a count query, return the count
+            logger.debug(
+                f"(utils.run_stackql_query) stackql query executed successfully, "
+                f"retrieved count: {result[0]['count']}."
+            )
+            if int(result[0]['count']) > 1:
                 catch_error_and_exit(
-                    f"(utils.run_stackql_query) an exception occurred during stackql query execution:\n\n{str(e)}\n",
+                    f"(utils.run_stackql_query) detected more than one resource matching the query criteria, "
+                    f"expected 0 or 1, got {result[0]['count']}\n",
                     logger
                 )
-            else:
-                logger.error(f"(utils.run_stackql_query) exception on attempt {attempt + 1}:\n\n{str(e)}\n")
+            return True, None
+        else:
+            # If no errors or errors are suppressed, return the result
+            logger.debug(
+                f"(utils.run_stackql_query) stackql query executed successfully, retrieved {len(result)} items."
+            )
+            return True, None
+    else:
+        # Handle unexpected result format
+        if attempt == retries:
+            catch_error_and_exit(
+                "(utils.run_stackql_query) unexpected result format received from stackql query execution.",
+                logger
+            )
+        else:
+            logger.error("(utils.run_stackql_query) unexpected result format, retrying...")
+        return False, None
 
-        # Delay before next attempt
-        time.sleep(delay)
-        attempt += 1
+def evaluate_query_exception(e, attempt, retries, logger):
+    """Handles an exception raised by a stackql query attempt, returns the error message."""
+    # Log the exception and check if retry attempts are exhausted
+    if attempt == retries:
+        catch_error_and_exit(
+            f"(utils.run_stackql_query) an exception occurred during stackql query execution:\n\n{str(e)}\n",
+            logger
+        )
+    else:
+        logger.error(f"(utils.run_stackql_query) exception on attempt {attempt + 1}:\n\n{str(e)}\n")
+    return str(e)
 
+def query_retries_exhausted(retries, suppress_errors, last_error, logger):
+    """Returns the result of a query once all attempts completed without a usable result."""
     logger.debug(f"(utils.run_stackql_query) all attempts ({retries + 1}) to execute the query completed.")
     # If suppress_errors is True and we have an error, return an empty list with error info as a special dict
     if suppress_errors and last_error:
@@ -118,6 +124,65 @@ def run_stackql_query(query, stackql, suppress_errors, logger, custom_auth=None,
     # return None
     return []
 
+def execute_query(query, stackql, suppress_errors, custom_auth=None, env_vars=None, cache=None, refresh=False):
+    """Executes a query, through the run-scoped query cache if provided.
+
+    If refresh is set the cached result (if any) is discarded and the query is re-run.
+    """
+    def execute():
+        return stackql.execute(query, suppress_errors=suppress_errors, custom_auth=custom_auth, env_vars=env_vars)
+
+    if cache is None:
+        return execute()
+    if refresh:
+        cache.discard(query, custom_auth, env_vars)
+    return cache.get_or_run(query, execute, custom_auth, env_vars)
+
+def query_span_attributes(query, attempt):
+    """Attributes of the span recorded for each attempt to run a stackql query or command."""
+    return {
+        'db.system': 'stackql',
+        'db.operation': query.split(None, 1)[0].upper() if query.strip() else None,
+        'stackql_deploy.attempt': attempt + 1,
+    }
+
+def count_rows(result):
+    return len(result) if isinstance(result, list) else None
+
+def run_stackql_query(
+        query, stackql, suppress_errors, logger, custom_auth=None, env_vars=None, retries=0, delay=5, cache=None
+):
+    policy = as_retry_policy(delay)
+    start_time = time.time()
+    attempt = 0
+    last_error = None
+    while attempt <= retries:
+        if policy.expired(start_time):
+            # wait budget used up, make this the final attempt
+            retries = attempt
+        try:
+            logger.debug("(utils.run_stackql_query) executing stackql query on attempt %s:\n\n%s\n", attempt + 1, query)
+            with span('stackql query', query_span_attributes(query, attempt), SPAN_KIND_CLIENT) as query_span:
+                result = execute_query(
+                    query, stackql, suppress_errors, custom_auth, env_vars, cache=cache, refresh=attempt > 0
+                )
+                query_span.set_attribute('stackql_deploy.rows', count_rows(result))
+            logger.debug("(utils.run_stackql_query) stackql query result (type:%s): %s", type(result), result)
+            done, error = evaluate_query_result(result, attempt, retries, suppress_errors, logger)
+            if done:
+                return result
+            last_error = error or last_error
+        except Exception as e:
+            last_error = evaluate_query_exception(e, attempt, retries, logger)
+
+        # Delay before next attempt
+        if attempt < retries:
+            with span('retry delay', {'stackql_deploy.attempt': attempt + 1}):
+                time.sleep(policy.get_delay(attempt, start_time))
+        attempt += 1
+
+    return query_retries_exhausted(retries, suppress_errors, last_error, logger)
+
 def error_detected(result):
     """parse stdout for known error conditions"""
     if result['message'].startswith('http response status code: 4') or \
@@ -131,6 +196,71 @@ def error_detected(result):
         return True
     return False
 
+def format_registry_pull(command):
+    """Rewrites a versioned `REGISTRY PULL <provider>::v<version>` command into stackql syntax."""
+    if command.startswith("REGISTRY PULL"):
+        match = re.match(r'(REGISTRY PULL \w+)(::v[\d\.]+)?', command)
+        if match:
+            service_provider = match.group(1)
+            version = match.group(2)
+            if version:
+                command = f"{service_provider} {version[2:]}"
+        else:
+            raise ValueError(
+                (
+                    "REGISTRY PULL command must be in the format 'REGISTRY PULL <service_provider>::v<version>'"
+                    "or 'REGISTRY PULL <service_provider>'"
+                )
+            )
+    return command
+
+def evaluate_command_result(result, attempt, retries, retry_delay, ignore_errors, logger):
+    """Evaluates the result of a single stackql command attempt.
+
+    Returns a tuple of (done, message): done is False when the command should be retried.
+    Exits on errors once retries are exhausted.
+    """
+    if isinstance(result, dict):
+        # If the result contains a message, it means the execution was successful
+        if 'message' in result:
+            if not ignore_errors and error_detected(result):
+                if attempt < retries:
+                    logger.warning(
+                        (
+                            f"dependent resource(s) may not be ready, retrying in {retry_delay} seconds "
+                            f"(attempt {attempt + 1} of {retries + 1})..."
+                        )
+                    )
+                    return False, None
+                else:
+                    catch_error_and_exit(
+                        (
+                            f"(utils.run_stackql_command) error occurred during stackql command execution:\n\n"
+                            f"{result['message']}\n"
+                        ),
+                        logger
+                    )
+            logger.debug(
+                f"(utils.run_stackql_command) stackql command executed successfully:\n\n{result['message']}\n"
+            )
+            return True, result['message'].rstrip()
+        elif 'error' in result:
+            # Check if the result contains an error message
+            error_message = result['error'].rstrip()
+            catch_error_and_exit(
+                (
+                    f"(utils.run_stackql_command) error occurred during stackql command execution:\n\n"
+                    f"{error_message}\n"
+                ),
+                logger
+            )
+
+    # If there's no 'error' or 'message', it's an unexpected result format
+    catch_error_and_exit(
+        "(utils.run_stackql_command) unexpected result format received from stackql execution.",
+        logger
+    )
+
 def run_stackql_command(command,
                         stackql,
                         logger,
@@ -138,75 +268,35 @@ def run_stackql_command(command,
                         env_vars=None,
                         ignore_errors=False,
                         retries=0,
-                        retry_delay=5
+                        retry_delay=5,
+                        cache=None
     ):
+    policy = as_retry_policy(retry_delay)
+    start_time = time.time()
     attempt = 0
     while attempt <= retries:
+        if policy.expired(start_time):
+            # wait budget used up, make this the final attempt
+            retries = attempt
         try:
             logger.debug(
-                f"(utils.run_stackql_command) executing stackql command (attempt {attempt + 1}):\n\n{command}\n"
+                "(utils.run_stackql_command) executing stackql command (attempt %s):\n\n%s\n", attempt + 1, command
             )
             # If query is start with 'REGISTRY PULL', check version
-            if command.startswith("REGISTRY PULL"):
-                match = re.match(r'(REGISTRY PULL \w+)(::v[\d\.]+)?', command)
-                if match:
-                    service_provider = match.group(1)
-                    version = match.group(2)
-                    if version:
-                        command = f"{service_provider} {version[2:]}"
-                else:
-                    raise ValueError(
-                        (
-                            "REGISTRY PULL command must be in the format 'REGISTRY PULL <service_provider>::v<version>'"
-                            "or 'REGISTRY PULL <service_provider>'"
-                        )
-                    )
+            command = format_registry_pull(command)
 
-            result = stackql.executeStmt(command, custom_auth, env_vars)
-            logger.debug(f"(utils.run_stackql_command) stackql command result:\n\n{result}, type: {type(result)}\n")
-
-            if isinstance(result, dict):
-                # If the result contains a message, it means the execution was successful
-                if 'message' in result:
-                    if not ignore_errors and error_detected(result):
-                        if attempt < retries:
-                            logger.warning(
-                                (
-                                    f"dependent resource(s) may not be ready, retrying in {retry_delay} seconds "
-                                    f"(attempt {attempt + 1} of {retries + 1})..."
-                                )
-                            )
-                            time.sleep(retry_delay)
-                            attempt += 1
-                            continue  # Retry the command
-                        else:
-                            catch_error_and_exit(
-                                (
-                                    f"(utils.run_stackql_command) error occurred during stackql command execution:\n\n"
-                                    f"{result['message']}\n"
-                                ),
-                                logger
-                            )
-                    logger.debug(
-                        f"(utils.run_stackql_command) stackql command executed successfully:\n\n{result['message']}\n"
-                    )
-                    return result['message'].rstrip()
-                elif 'error' in result:
-                    # Check if the result contains an error message
-                    error_message = result['error'].rstrip()
-                    catch_error_and_exit(
-                        (
-                            f"(utils.run_stackql_command) error occurred during stackql command execution:\n\n"
-                            f"{error_message}\n"
-                        ),
-                        logger
-                    )
+            with span('stackql command', query_span_attributes(command, attempt), SPAN_KIND_CLIENT):
+                result = stackql.executeStmt(command, custom_auth, env_vars)
+            if cache is not None:
+                cache.invalidate(command)
+            logger.debug("(utils.run_stackql_command) stackql command result:\n\n%s, type: %s\n", result, type(result))
 
-            # If there's no 'error' or 'message', it's an unexpected result format
-            catch_error_and_exit(
-                "(utils.run_stackql_command) unexpected result format received from stackql execution.",
-                logger
-            )
+            delay = policy.get_delay(attempt, start_time)
+            done, message = evaluate_command_result(result, attempt, retries, delay, ignore_errors, logger)
+            if done:
+                return message
+            with span('retry delay', {'stackql_deploy.attempt': attempt + 1}):
+                time.sleep(delay)
 
         except Exception as e:
             # Log the exception and exit
@@ -215,62 +305,75 @@ def run_stackql_command(command,
                 logger
             )
 
-        # Increment attempt counter if not continuing the loop due to retry
         attempt += 1
 
 def pull_providers(providers, stackql, logger):
-    logger.debug(f"(utils.pull_providers) stackql run time info:\n\n{json.dumps(stackql.properties(), indent=2)}\n")
+    """Pulls the manifest providers which are not already installed.
+
+    Registry version checks and pulls for each provider are run concurrently.
+    """
+    logger.debug(
+        "(utils.pull_providers) stackql run time info:\n\n%s\n",
+        lazy_format(lambda: json.dumps(stackql.properties(), indent=2))
+    )
     installed_providers = run_stackql_query("SHOW PROVIDERS", stackql, False, logger) # not expecting an error here
-    # check if the provider is already installed
-    for provider in providers:
-        # check if the provider is a specific version
-        if "::" in provider:
-            name, version = provider.split("::")
-            check_provider_version_available(name, version, stackql, logger)
-            found = False
-            # provider is a version which will be installed
-            # installed is a version which is already installed
-            for installed in installed_providers:
-                # if name and version are the same, it's already installed
-                if installed["name"] == name and installed["version"] == version:
-                    logger.info(f"provider '{provider}' is already installed.")
-                    found = True
-                    break
-                # if name is the same but the installed version is higher,
-                # it's already installed(latest version)
-                elif installed["name"] == name and is_installed_version_higher(installed["version"], version, logger):
-                    logger.warning(
-                        (
-                            f"provider '{name}' version '{version}' is not available in the registry, "
-                            f"but a higher version '{installed['version']}' is already installed."
-                        )
-                    )
-                    logger.warning(
-                        "If you want to install the lower version, you must delete the higher version "
-                        "folder from the stackql providers directory."
+    # installed versions by provider name
+    installed_versions = {}
+    for installed in installed_providers:
+        installed_versions.setdefault(installed["name"], []).append(installed["version"])
+
+    providers = list(dict.fromkeys(providers))
+    if len(providers) < 2:
+        for provider in providers:
+            pull_provider(provider, installed_versions, stackql, logger)
+        return
+
+    with ThreadPoolExecutor(max_workers=len(providers), thread_name_prefix='stackql-deploy') as executor:
+        futures = [
+            executor.submit(in_current_context(pull_provider), provider, installed_versions, stackql, logger)
+            for provider in providers
+        ]
+    for future in futures:
+        # raises the first failure, e.g. a version not found in the registry
+        future.result()
+
+def pull_provider(provider, installed_versions, stackql, logger):
+    """Pulls a provider (`name` or `name::version`) unless it is already installed."""
+    # check if the provider is a specific version
+    if "::" in provider:
+        name, version = provider.split("::")
+        # provider is a version which will be installed
+        # installed is a version which is already installed
+        if version in installed_versions.get(name, []):
+            # if name and version are the same, it's already installed
+            logger.info(f"provider '{provider}' is already installed.")
+            return
+        check_provider_version_available(name, version, stackql, logger)
+        for installed_version in installed_versions.get(name, []):
+            # if name is the same but the installed version is higher,
+            # it's already installed(latest version)
+            if is_installed_version_higher(installed_version, version, logger):
+                logger.warning(
+                    (
+                        f"provider '{name}' version '{version}' is not available in the registry, "
+                        f"but a higher version '{installed_version}' is already installed."
                     )
-                    logger.info(f"provider {name}::{version} is already installed.")
-                    found = True
-                    break
-            # if not found, pull the provider
-            if not found:
-                logger.info(f"pulling provider '{provider}'...")
-                msg = run_stackql_command(f"REGISTRY PULL {provider}", stackql, logger)
-                logger.info(msg)
-        else:
-            found = False
-            # provider is a name which will be installed
-            # installed is a list of providers which are already installed
-            for installed in installed_providers:
-                if installed["name"] == provider:
-                    logger.info(f"provider '{provider}' is already installed.")
-                    found = True
-                    break
-            # if not found, pull the provider
-            if not found:
-                logger.info(f"pulling provider '{provider}'...")
-                msg = run_stackql_command(f"REGISTRY PULL {provider}", stackql, logger)
-                logger.info(msg)
+                )
+                logger.warning(
+                    "If you want to install the lower version, you must delete the higher version "
+                    "folder from the stackql providers directory."
+                )
+                logger.info(f"provider {name}::{version} is already installed.")
+                return
+    elif provider in installed_versions:
+        # provider is a name which will be installed
+        logger.info(f"provider '{provider}' is already installed.")
+        return
+
+    # not found, pull the provider
+    logger.info(f"pulling provider '{provider}'...")
+    msg = run_stackql_command(f"REGISTRY PULL {provider}", stackql, logger)
+    logger.info(msg)
 
 def check_provider_version_available(provider_name, version, stackql, logger):
     """Check if the provider version is available in the registry.
@@ -328,48 +431,58 @@ def is_installed_version_higher(installed_version, requested_version, logger):
             logger
         )
 
-def run_test(resource, rendered_test_iql, stackql, logger, delete_test=False, custom_auth=None, env_vars=None):
+def evaluate_test_result(resource, test_result, delete_test, logger):
+    """Evaluates the result of an exists, statecheck or post-delete test query."""
+    logger.debug("(utils.run_test) test query result for [%s]:\n\n%s\n", resource['name'], test_result)
+
+    if test_result == []:
+        if delete_test:
+            logger.debug(f"(utils.run_test) delete test result true for [{resource['name']}]")
+            return True
+        else:
+            logger.debug(f"(utils.run_test) test result false for [{resource['name']}]")
+            return False
+
+    if not test_result or 'count' not in test_result[0]:
+        catch_error_and_exit(
+            f"(utils.run_test) data structure unexpected for [{resource['name']}] test:\n\n{test_result}\n", logger
+        )
+
+    count = int(test_result[0]['count'])
+    if delete_test:
+        if count == 0:
+            logger.debug(f"(utils.run_test) delete test result true for [{resource['name']}].")
+            return True
+        else:
+            logger.debug(
+                f"(utils.run_test) delete test result false for [{resource['name']}], expected 0 got {count}."
+            )
+            return False
+    else:
+        # not a delete test, 1 of the things should exist
+        if count == 1:
+            logger.debug(f"(utils.run_test) test result true for [{resource['name']}].")
+            return True
+        else:
+            logger.debug(f"(utils.run_test) test result false for [{resource['name']}], expected 1 got {count}.")
+            return False
+
+def run_test(
+        resource, rendered_test_iql, stackql, logger, delete_test=False, custom_auth=None, env_vars=None,
+        cache=None, refresh=False
+):
     try:
+        if cache is not None and refresh:
+            cache.discard(rendered_test_iql, custom_auth, env_vars)
         test_result = run_stackql_query(
             rendered_test_iql,
             stackql,
             True,
             logger,
             custom_auth=custom_auth,
-            env_vars=env_vars)
-        logger.debug(f"(utils.run_test) test query result for [{resource['name']}]:\n\n{test_result}\n")
-
-        if test_result == []:
-            if delete_test:
-                logger.debug(f"(utils.run_test) delete test result true for [{resource['name']}]")
-                return True
-            else:
-                logger.debug(f"(utils.run_test) test result false for [{resource['name']}]")
-                return False
-
-        if not test_result or 'count' not in test_result[0]:
-            catch_error_and_exit(
-                f"(utils.run_test) data structure unexpected for [{resource['name']}] test:\n\n{test_result}\n", logger
-            )
-
-        count = int(test_result[0]['count'])
-        if delete_test:
-            if count == 0:
-                logger.debug(f"(utils.run_test) delete test result true for [{resource['name']}].")
-                return True
-            else:
-                logger.debug(
-                    f"(utils.run_test) delete test result false for [{resource['name']}], expected 0 got {count}."
-                )
-                return False
-        else:
-            # not a delete test, 1 of the things should exist
-            if count == 1:
-                logger.debug(f"(utils.run_test) test result true for [{resource['name']}].")
-                return True
-            else:
-                logger.debug(f"(utils.run_test) test result false for [{resource['name']}], expected 1 got {count}.")
-                return False
+            env_vars=env_vars,
+            cache=cache)
+        return evaluate_test_result(resource, test_result, delete_test, logger)
 
     except Exception as e:
         catch_error_and_exit(
@@ -389,23 +502,43 @@ def perform_retries(resource,
                     logger,
                     delete_test=False,
                     custom_auth=None,
-                    env_vars=None
+                    env_vars=None,
+                    cache=None
     ):
+    policy = as_retry_policy(delay)
     attempt = 0
     start_time = time.time()  # Capture the start time of the operation
     while attempt < retries:
-        result = run_test(resource, query, stackql, logger, delete_test, custom_auth=custom_auth, env_vars=env_vars)
+        # polls always reach the provider, only the first check can be served from the cache
+        with span('check attempt', {'stackql_deploy.attempt': attempt + 1}) as attempt_span:
+            result = run_test(
+                resource, query, stackql, logger, delete_test, custom_auth=custom_auth, env_vars=env_vars,
+                cache=cache, refresh=attempt > 0
+            )
+            attempt_span.set_attribute('stackql_deploy.result', result)
         if result:
             return True
+        if attempt + 1 >= retries or policy.expired(start_time):
+            break
         elapsed = time.time() - start_time  # Calculate elapsed time
+        attempt_delay = policy.get_delay(attempt, start_time)
         logger.info(
-            f"🕒 attempt {attempt + 1}/{retries}: retrying in {delay} seconds ({int(elapsed)} seconds elapsed)."
+            f"🕒 attempt {attempt + 1}/{retries}: retrying in {attempt_delay} seconds ({int(elapsed)} seconds elapsed)."
         )
-        time.sleep(delay)
+        with span('retry delay', {'stackql_deploy.attempt': attempt + 1}):
+            time.sleep(attempt_delay)
         attempt += 1
     elapsed = time.time() - start_time  # Calculate total elapsed time
     return False
 
+def normalize_value(value):
+    """Unwraps nullable string values (`{'String': ..., 'Valid': ...}`) and decodes bytes returned by stackql."""
+    if isinstance(value, dict) and 'String' in value:
+        return value['String']
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode('utf-8')
+    return value
+
 def export_vars(self, resource, export, expected_exports, expected_exports_all_dicts, protected_exports):
     for item in expected_exports:
         # check if all items are dictionaries
@@ -425,18 +558,23 @@ def export_vars(self, resource, export, expected_exports, expected_exports_all_d
                     self.logger
                 )
     for key, value in export.items():
+        value = as_context_value(value)
         if key in protected_exports:
             mask = '*' * len(str(value))
             self.logger.info(f"🔒 set protected variable [{key}] to [{mask}] in exports")
         else:
             self.logger.info(f"📤 set [{key}] to [{value}] in exports")
         # Update global context with exported values
-        self.global_context[key] = value
+        with self.context_lock:
+            self.global_context[key] = value
+            # protected values are not written to the state file
+            if key not in protected_exports:
+                self.resource_exports.setdefault(resource['name'], {})[key] = value
 
 def run_ext_script(cmd, logger, exports=None):
     try:
         result = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, shell=True)
-        logger.debug(f"(utils.run_ext_script) script output: {result.stdout}")
+        logger.debug("(utils.run_ext_script) script output: %s", result.stdout)
         if not exports:
             return True
     except Exception as e:
@@ -488,7 +626,7 @@ def check_exports_as_statecheck_proxy(exports_result, logger):
     Returns True if exports indicate resource is in correct state (non-empty result),
     False if exports indicate statecheck failed (empty result).
     """
-    logger.debug(f"(utils.check_exports_as_statecheck_proxy) checking exports result: {exports_result}")
+    logger.debug("(utils.check_exports_as_statecheck_proxy) checking exports result: %s", exports_result)
 
     # If exports is None or empty list, consider statecheck failed
     if exports_result is None or len(exports_result) == 0:
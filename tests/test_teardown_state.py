@@ -0,0 +1,66 @@
+import json
+import logging
+import threading
+from stackql_deploy.cmd.teardown import StackQLDeProvisioner
+from stackql_deploy.lib.state import get_missing_exports, new_state
+
+RESOURCES = [
+    {'name': 'vpc', 'exports': ['vpc_id']},
+    {'name': 'subnet', 'exports': ['subnet_id', {'subnet_cidr': 'cidr_block'}]},
+    {'name': 'secret', 'exports': ['secret_arn', 'secret_value'], 'protected': ['secret_value']},
+    {'name': 'check', 'type': 'query'},
+]
+
+def write_state(tmp_path, resources):
+    state = new_state('test-stack', 'dev')
+    state['resources'] = {name: {'exports': exports} for name, exports in resources.items()}
+    path = tmp_path / 'dev.state.json'
+    path.write_text(json.dumps(state))
+    return str(path)
+
+def deprovisioner():
+    # only the attributes restore_exports uses, no stackql instance required
+    deprovisioner = StackQLDeProvisioner.__new__(StackQLDeProvisioner)
+    deprovisioner.logger = logging.getLogger('stackql-deploy-test')
+    deprovisioner.manifest = {'name': 'test-stack', 'resources': RESOURCES}
+    deprovisioner.stack_name = 'test-stack'
+    deprovisioner.stack_env = 'dev'
+    deprovisioner.context_lock = threading.RLock()
+    deprovisioner.global_context = {}
+    return deprovisioner
+
+def test_missing_exports():
+    state = {'resources': {'subnet': {'exports': {'subnet_id': 'subnet-1'}}}}
+    assert get_missing_exports(state, RESOURCES[0]) == {'vpc_id'}
+    assert get_missing_exports(state, RESOURCES[1]) == {'cidr_block'}
+    assert get_missing_exports(state, RESOURCES[3]) == set()
+
+def test_restore_exports_covered(tmp_path):
+    state_file = write_state(tmp_path, {
+        'vpc': {'vpc_id': 'vpc-1'},
+        'subnet': {'subnet_id': 'subnet-1', 'cidr_block': '10.0.0.0/24'},
+        'secret': {'secret_arn': 'arn:1'},
+    })
+    teardown = deprovisioner()
+    uncovered = teardown.restore_exports(state_file, {0, 1, 3})
+    assert uncovered == set()
+    assert teardown.global_context['vpc_id'] == 'vpc-1'
+    assert teardown.global_context['cidr_block'] == '10.0.0.0/24'
+
+def test_restore_exports_partial_state(tmp_path):
+    state_file = write_state(tmp_path, {
+        'vpc': {'vpc_id': 'vpc-1'},
+        'subnet': {'subnet_id': 'subnet-1'},
+        'secret': {'secret_arn': 'arn:1'},
+    })
+    teardown = deprovisioner()
+    # protected exports are never recorded, so they are always collected
+    assert teardown.restore_exports(state_file, {0, 1, 2, 3}) == {1, 2}
+    assert teardown.global_context['subnet_id'] == 'subnet-1'
+
+def test_restore_exports_missing_resource(tmp_path):
+    state_file = write_state(tmp_path, {'subnet': {'subnet_id': 'subnet-1', 'cidr_block': '10.0.0.0/24'}})
+    teardown = deprovisioner()
+    assert teardown.restore_exports(state_file, {0, 1}) == {0}
+    # only the selected resources are checked
+    assert teardown.restore_exports(state_file, {1}) == set()
@@ -0,0 +1,53 @@
+import logging
+import os
+from jinja2 import FileSystemBytecodeCache
+from stackql_deploy.lib.filters import (
+    TEMPLATE_CACHE_DIR,
+    TEMPLATE_CACHE_DIR_ENV,
+    get_bytecode_cache,
+    get_template_cache_dir,
+    prune_template_cache,
+    setup_environment,
+)
+
+logger = logging.getLogger('stackql-deploy-test')
+
+def test_template_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv(TEMPLATE_CACHE_DIR_ENV, raising=False)
+    assert get_template_cache_dir() == TEMPLATE_CACHE_DIR
+    monkeypatch.setenv(TEMPLATE_CACHE_DIR_ENV, str(tmp_path))
+    assert get_template_cache_dir() == str(tmp_path)
+    monkeypatch.setenv(TEMPLATE_CACHE_DIR_ENV, 'off')
+    assert get_template_cache_dir() is None
+
+def test_template_cache_disabled(monkeypatch):
+    monkeypatch.setenv(TEMPLATE_CACHE_DIR_ENV, 'off')
+    assert get_bytecode_cache(logger) is None
+
+def test_template_cache_configured(monkeypatch, tmp_path):
+    cache_dir = tmp_path / 'templates'
+    monkeypatch.setenv(TEMPLATE_CACHE_DIR_ENV, str(cache_dir))
+    env = setup_environment(str(tmp_path), logger)
+    assert isinstance(env.bytecode_cache, FileSystemBytecodeCache)
+    assert env.from_string("{{ name }}").render(name='vpc') == 'vpc'
+    assert len(os.listdir(cache_dir)) == 1
+
+def test_template_cache_fallback(monkeypatch, tmp_path):
+    # the cache directory can't be created under a file
+    blocker = tmp_path / 'blocker'
+    blocker.write_text('')
+    monkeypatch.setenv(TEMPLATE_CACHE_DIR_ENV, str(blocker / 'templates'))
+    env = setup_environment(str(tmp_path), logger)
+    assert env.bytecode_cache is None
+    # compiled templates are still cached in memory
+    assert env.from_string("{{ name }}").render(name='vpc') == 'vpc'
+    assert env.from_string("{{ name }}") is env.from_string("{{ name }}")
+    assert not os.path.exists(blocker / 'templates')
+
+def test_prune_template_cache(tmp_path):
+    for i in range(5):
+        path = tmp_path / f"__jinja2_{i}.cache"
+        path.write_text('')
+        os.utime(path, ns=(i * 10**9, i * 10**9))
+    prune_template_cache(str(tmp_path), logger, max_entries=3)
+    assert sorted(os.listdir(tmp_path)) == ['__jinja2_2.cache', '__jinja2_3.cache', '__jinja2_4.cache']
@@ -22,6 +22,7 @@ const sidebars = {
       label: 'CLI Command Reference',
       items: [
         'cli-reference/build',
+        'cli-reference/bundle',
         'cli-reference/init',
         'cli-reference/teardown',
         'cli-reference/test',